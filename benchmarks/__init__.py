@@ -0,0 +1,52 @@
+"""
+Benchmarks of the numerical hot paths of the scripts in this manual.
+
+Every benchmark is a setup function that takes a problem size and returns the
+callable to time. The data is made by the synthetic generators in
+benchmarks.generators, so the benchmarks run offline and do not need any of the
+data files used in the manual. Benchmarks that need a library that is not
+installed (fx. ivs or pyfits) are reported as skipped.
+
+Run all benchmarks and compare with a stored baseline:
+
+   python -m benchmarks -o results.json -baseline baseline.json
+
+See benchmarks/run.py for all options.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#-- name: (setup function, sizes)
+BENCHMARKS = {}
+
+
+def benchmark(name, sizes):
+   """
+   Register a benchmark.
+
+   :parameter str name: name of the benchmark, fx. 'pixgrid.lookup'
+   :parameter list sizes: problem sizes to run the benchmark for
+   """
+   def register(setup):
+      BENCHMARKS[name] = (setup, list(sizes))
+      return setup
+   return register
+
+def import_script(path):
+   """
+   Import one of the scripts of the manual by its path relative to the root of
+   the repository. The script directory is added to sys.path, so the script can
+   import its neighbours.
+   """
+   path = os.path.join(ROOT, path)
+   directory, fname = os.path.split(path)
+   if not directory in sys.path:
+      sys.path.insert(0, directory)
+
+   name = os.path.splitext(fname)[0]
+   if name in sys.modules:
+      return sys.modules[name]
+   return __import__(name)
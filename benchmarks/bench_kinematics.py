@@ -0,0 +1,16 @@
+"""
+Benchmark of the U, V, W space velocity recipe over large catalogues.
+"""
+
+from benchmarks import benchmark, import_script, generators
+
+
+@benchmark('kinematics.uvw', sizes=[10**4, 10**5, 10**6, 10**7])
+def uvw(size, workdir):
+   """
+   Space velocities of a catalogue (size = number of stars)
+   """
+   uvw = import_script('galactic_kinematics/scripts/uvw.py')
+   cat = generators.catalogue(size)
+
+   return lambda: uvw.uvw(**cat)
@@ -0,0 +1,16 @@
+"""
+Benchmark of the Monte Carlo error estimate of the gravitational redshift.
+"""
+
+from benchmarks import benchmark, import_script
+
+
+@benchmark('zg2logg.calc_gr_mc', sizes=[10**4, 10**5, 10**6, 10**7])
+def calc_gr_mc(size, workdir):
+   """
+   logg of the sdB from the gravitational redshift (size = number of draws)
+   """
+   Zg2logg = import_script('gravitational_redshift/scripts/Zg2logg.py')
+
+   return lambda: Zg2logg.calc_gr_mc((4.36, 0.42), (0.86, 0.07), (0.47, 0.05),
+                                     (1.34, 0.51), size)
@@ -0,0 +1,96 @@
+"""
+Benchmarks of the SED fitting hot paths: synthetic photometry of model spectra,
+loading the integrated grids and interpolating in them, and the Monte Carlo
+zero point fit.
+"""
+
+import os
+import shutil
+
+import numpy as np
+
+from benchmarks import benchmark, import_script, generators
+
+
+@benchmark('sed.synthetic_flux', sizes=[10, 100, 1000])
+def synthetic_flux(size, workdir):
+   """
+   model.synthetic_flux over many model spectra (size = number of spectra)
+   """
+   from ivs.sed import model
+
+   photbands = ['GALEX.FUV', 'GALEX.NUV', 'JOHNSON.B', 'JOHNSON.V', '2MASS.J', '2MASS.KS']
+   wave, fluxes = generators.spectra(size)
+
+   def run():
+      for flux in fluxes:
+         model.synthetic_flux(wave, flux, photbands=photbands)
+   return run
+
+def _make_grid(workdir, nteff):
+   """
+   Write a synthetic integrated grid with nteff temperatures (x 10 logg x 25 ebv).
+   """
+   gridstore = import_script('sed/scripts/gridstore.py')
+
+   path = os.path.join(workdir, 'grid_%i.igrid' % nteff)
+   if not gridstore.is_store(path):
+      columns, names = generators.integrated_grid(nteff=nteff)
+      gridstore.create(path, columns, names=names)
+   return path
+
+@benchmark('pixgrid.cold', sizes=[10, 40, 160])
+def pixgrid_cold(size, workdir):
+   """
+   First use of a grid: load and reshape the grid and write the cache
+   (size = number of teff points in the grid)
+   """
+   pixgrid = import_script('sed/scripts/pixgrid.py')
+   path = _make_grid(workdir, size)
+
+   def run():
+      shutil.rmtree(pixgrid.get_cachedir([path]), ignore_errors=True)
+      pixgrid._loaded.clear()
+      pixgrid.get_pixelgrid(grid=path)
+   return run
+
+@benchmark('pixgrid.warm', sizes=[10, 40, 160])
+def pixgrid_warm(size, workdir):
+   """
+   Use of a grid in a new process: memory-map the existing cache
+   (size = number of teff points in the grid)
+   """
+   pixgrid = import_script('sed/scripts/pixgrid.py')
+   path = _make_grid(workdir, size)
+   pixgrid.get_pixelgrid(grid=path)
+
+   def run():
+      pixgrid._loaded.clear()
+      pixgrid.get_pixelgrid(grid=path)
+   return run
+
+@benchmark('pixgrid.lookup', sizes=[1000, 10000, 100000, 1000000])
+def pixgrid_lookup(size, workdir):
+   """
+   Interpolation of integrated photometry (size = number of models)
+   """
+   pixgrid = import_script('sed/scripts/pixgrid.py')
+   path = _make_grid(workdir, 40)
+   pixgrid.get_pixelgrid(grid=path)
+
+   rng = np.random.RandomState(0)
+   teff, logg = rng.uniform(6000, 39000, size), rng.uniform(3.5, 6.0, size)
+   ebv = rng.uniform(0, 0.45, size)
+
+   return lambda: pixgrid.get_itable_pix(teff=teff, logg=logg, ebv=ebv, grid=path)
+
+@benchmark('zeropoints.mc', sizes=[50, 200, 1000])
+def zeropoints_mc(size, workdir):
+   """
+   Monte Carlo zero point and slope fit of calculate_zeropoints.py
+   (size = number of calibrators)
+   """
+   calculate_zeropoints = import_script('sed/scripts/calculate_zeropoints.py')
+   color, syn, obs, err = generators.calibrators(size)
+
+   return lambda: calculate_zeropoints.mc(color, syn, obs, err)
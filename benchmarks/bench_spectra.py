@@ -0,0 +1,58 @@
+"""
+Benchmarks of the interactive spectrum viewer (SFI) on large spectra: zooming
+in and out, and the rescan of the plotted data for the axis limits.
+"""
+
+from benchmarks import benchmark, import_script, generators
+
+
+class _Event(object):
+   """
+   The attributes of a matplotlib scroll event that SFI uses.
+   """
+   def __init__(self, axes, x, y, button):
+      self.inaxes, self.xdata, self.ydata, self.button = axes, x, y, button
+
+def _make_sfi(size):
+   import matplotlib
+   matplotlib.use('Agg')
+   import pylab as pl
+
+   sfi = import_script('spectra/scripts/sfi.py')
+
+   wave, flux = generators.observed_spectrum(size)
+   fig = pl.figure()
+   ax = fig.add_subplot(111)
+   ax.plot(wave, flux, '-b')
+
+   #-- only the attributes used when zooming, no event handlers are connected
+   sf = sfi.SFI.__new__(sfi.SFI)
+   sf.fig, sf.wave, sf.flux, sf.zoom = fig, wave, flux, 0.5
+
+   return sf, ax
+
+@benchmark('sfi.zoom', sizes=[10**5, 10**6, 4 * 10**6])
+def sfi_zoom(size, workdir):
+   """
+   Zoom in and out once around the center of the spectrum (size = number of pixels)
+   """
+   sf, ax = _make_sfi(size)
+   x, y = sf.wave[len(sf.wave) // 2], 0.9
+
+   def run():
+      sf.onScroll(_Event(ax, x, y, 'up'))
+      sf.onScroll(_Event(ax, x, y, 'down'))
+   return run
+
+@benchmark('sfi.rescan', sizes=[10**5, 10**6, 4 * 10**6])
+def sfi_rescan(size, workdir):
+   """
+   Rescan of the plotted data for the axis limits (size = number of pixels)
+   """
+   sf, ax = _make_sfi(size)
+
+   def run():
+      sf.get_visble_ylim(ax)
+      sf.get_xdata_limits(ax)
+      sf.get_ydata_limits(ax)
+   return run
@@ -0,0 +1,104 @@
+"""
+Synthetic data generators for the benchmarks.
+
+All generators take a size and a random seed, and return data with the same
+structure (and roughly the same value ranges) as the real data used in the
+manual, so the benchmarks can run without any data files.
+"""
+
+import numpy as np
+
+#-- Planck constants in cgs
+_h, _c, _k = 6.62607e-27, 2.99792458e10, 1.380649e-16
+
+
+def blackbody(wave, teff):
+   """
+   Blackbody flux (erg/s/cm2/AA) on a wavelength grid in AA.
+   """
+   wave_cm = np.asarray(wave, float) * 1e-8
+   with np.errstate(over='ignore'):
+      bb = 2 * _h * _c**2 / wave_cm**5 / (np.exp(_h * _c / (wave_cm * _k * teff)) - 1)
+   return bb * 1e-8
+
+def spectra(n, npix=5000, wrange=(1000, 30000), seed=0):
+   """
+   n blackbody spectra with teff between 5000 and 40000 K on a log wavelength
+   grid, like the model SEDs.
+
+   :return: (wave, fluxes) with fluxes of shape (n x npix)
+   """
+   rng = np.random.RandomState(seed)
+   wave = np.logspace(np.log10(wrange[0]), np.log10(wrange[1]), npix)
+   teffs = rng.uniform(5000, 40000, n)
+   return wave, np.array([blackbody(wave, t) for t in teffs])
+
+def observed_spectrum(npix, wrange=(3700, 9000), nlines=2000, seed=0):
+   """
+   A normalised spectrum with gaussian absorption lines and noise, like an
+   echelle spectrum used in SFI.
+
+   :return: (wave, flux)
+   """
+   rng = np.random.RandomState(seed)
+   wave = np.linspace(wrange[0], wrange[1], npix)
+   flux = np.ones(npix)
+
+   centers = rng.uniform(wrange[0], wrange[1], nlines)
+   depths = rng.uniform(0.01, 0.6, nlines)
+   widths = rng.uniform(0.05, 1.0, nlines)
+   dw = wave[1] - wave[0]
+   for c, d, w in zip(centers, depths, widths):
+      i0, i1 = np.searchsorted(wave, [c - 5 * w, c + 5 * w])
+      flux[i0:i1] -= d * np.exp(-0.5 * ((wave[i0:i1] - c) / w)**2)
+
+   return wave, flux + rng.normal(0, 0.01, npix)
+
+def integrated_grid(nteff=40, nlogg=10, nebv=25, nbands=20, seed=0):
+   """
+   Columns of a synthetic integrated grid: a regular teff-logg-ebv grid with
+   blackbody fluxes in nbands boxcar 'photbands'.
+
+   :return: (columns, names) to be written with gridstore.create
+   """
+   rng = np.random.RandomState(seed)
+   teffs = np.linspace(5000, 40000, nteff)
+   loggs = np.linspace(3.0, 6.5, nlogg)
+   ebvs = np.linspace(0, 0.5, nebv)
+
+   T, G, E = [a.ravel() for a in np.meshgrid(teffs, loggs, ebvs, indexing='ij')]
+   bands = np.logspace(np.log10(1500), np.log10(25000), nbands)
+
+   columns = dict(teff=T, logg=G, ebv=E, labs=(T / 5777.)**4 * rng.uniform(0.9, 1.1, len(T)))
+   names = ['teff', 'logg', 'ebv', 'labs']
+   for i, w in enumerate(bands):
+      name = 'SYN.B%02i' % i
+      columns[name] = blackbody(w, T) * 10**(-0.4 * E * 3.1 * 5500. / w)
+      names.append(name)
+
+   return columns, names
+
+def catalogue(n, seed=0):
+   """
+   A catalogue of positions, proper motions, distances and radial velocities.
+
+   :return: dict with ra, dec, pmra, pmdec, d and vrad
+   """
+   rng = np.random.RandomState(seed)
+   return dict(ra=rng.uniform(0, 360, n), dec=np.degrees(np.arcsin(rng.uniform(-1, 1, n))),
+               pmra=rng.normal(0, 20, n), pmdec=rng.normal(0, 20, n),
+               d=rng.uniform(50, 5000, n), vrad=rng.normal(0, 50, n))
+
+def calibrators(n, seed=0):
+   """
+   Synthetic and observed magnitudes of n calibrators, as used in the zero
+   point fit of calculate_zeropoints.py.
+
+   :return: (color, syn, obs, err)
+   """
+   rng = np.random.RandomState(seed)
+   color = rng.uniform(-0.3, 1.5, n)
+   syn = rng.uniform(6, 14, n)
+   err = rng.uniform(0.01, 0.05, n)
+   obs = syn - 0.02 + 0.01 * color + rng.normal(0, 1, n) * err
+   return color, syn, obs, err
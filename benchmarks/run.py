@@ -0,0 +1,265 @@
+"""
+Run the benchmarks, write the results to JSON and compare with a baseline.
+
+   python -m benchmarks [-o results.json] [-baseline baseline.json] [-only NAME]
+                        [-quick] [-maxtime 10] [-threshold 1.2]
+
+For every benchmark and size the best and median time, the throughput (size per
+second) and the peak memory allocated during one call are measured (on python 2,
+which has no tracemalloc, the peak growth of the resident set size instead). For every
+benchmark with more than one size the scaling exponent (slope of log(time)
+versus log(size)) is calculated.
+
+Results format:
+
+   {"version": 1, "created": "...", "machine": {...},
+    "results": [{"name": "pixgrid.lookup", "size": 10000, "status": "ok",
+                 "time": 0.012, "median": 0.013, "repeat": 7,
+                 "throughput": 830000.0, "peak_memory": 5240000}, ...],
+    "scaling": {"pixgrid.lookup": 0.98, ...}}
+
+When a baseline is given, every result is compared with the baseline result of
+the same benchmark and size, and the exit code is 1 if any benchmark is slower
+than threshold times the baseline, or ran in the baseline but now fails or is
+skipped.
+"""
+
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import platform
+import tempfile
+import threading
+import traceback
+
+import numpy as np
+
+from benchmarks import BENCHMARKS, import_script
+from benchmarks import bench_sed, bench_redshift, bench_kinematics, bench_spectra
+
+try:
+   import tracemalloc
+except ImportError:
+   tracemalloc = None
+
+RESULTS_VERSION = 1
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def _sample_rss(func, interval=0.001):
+   """
+   Peak growth of the resident set size during one call, for python versions
+   without tracemalloc. The RSS is sampled in a background thread, so short
+   peaks can be missed, and memory that is reused from earlier calls is not
+   counted.
+
+   :return: peak growth in bytes, None if the RSS can not be read
+   """
+   current_rss = import_script('sed/scripts/instrument.py').current_rss
+   start = current_rss()
+   if start is None:
+      return None
+
+   samples = [start]
+   stopped = threading.Event()
+   def sample():
+      while not stopped.is_set():
+         samples.append(current_rss())
+         stopped.wait(interval)
+
+   sampler = threading.Thread(target=sample)
+   sampler.daemon = True
+   sampler.start()
+   try:
+      func()
+   finally:
+      stopped.set()
+      sampler.join()
+   samples.append(current_rss())
+
+   return max(samples) - start
+
+def measure(func, maxtime=10., maxrepeat=20):
+   """
+   Time a callable. It is called once to warm up, and then repeated until
+   maxtime seconds or maxrepeat calls are reached (at least once).
+
+   :return: dict with time (best), median, repeat and peak_memory
+   """
+   func()
+
+   times = []
+   start = _timer()
+   while len(times) < maxrepeat and (not times or _timer() - start < maxtime):
+      t0 = _timer()
+      func()
+      times.append(_timer() - t0)
+
+   if tracemalloc is not None:
+      tracemalloc.start()
+      func()
+      peak = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+   else:
+      peak = _sample_rss(func)
+
+   return dict(time=min(times), median=float(np.median(times)), repeat=len(times),
+               peak_memory=peak)
+
+def scaling(results):
+   """
+   Scaling exponent of every benchmark with at least two successful sizes.
+   """
+   exponents = {}
+   for name in sorted(set([r['name'] for r in results])):
+      ok = [r for r in results if r['name'] == name and r['status'] == 'ok']
+      if len(ok) > 1:
+         coef = np.polyfit(np.log([r['size'] for r in ok]), np.log([r['time'] for r in ok]), 1)
+         exponents[name] = float(coef[0])
+   return exponents
+
+def run(names=None, quick=False, maxtime=10., verbose=True):
+   """
+   Run the benchmarks.
+
+   :parameter list names: names or patterns (fx. 'pixgrid.*') to run, default all
+   :parameter bool quick: only run the two smallest sizes of every benchmark
+   :parameter float maxtime: maximum time to spend repeating one measurement
+   :return: the results dictionary
+   """
+   selected = sorted(BENCHMARKS.keys())
+   if names:
+      selected = [n for n in selected if any([fnmatch.fnmatch(n, p) for p in names])]
+
+   results = []
+   workdir = tempfile.mkdtemp(prefix='sdb_benchmarks_')
+   try:
+      for name in selected:
+         setup, sizes = BENCHMARKS[name]
+         for size in (sizes[:2] if quick else sizes):
+            result = dict(name=name, size=size)
+            try:
+               func = setup(size, workdir)
+            except ImportError as e:
+               result.update(status='skipped', reason='%s: %s' % (type(e).__name__, e))
+            except Exception as e:
+               result.update(status='error', reason=traceback.format_exc().splitlines()[-1])
+            else:
+               try:
+                  result.update(measure(func, maxtime=maxtime), status='ok')
+                  result['throughput'] = size / result['time']
+               except Exception as e:
+                  result.update(status='error', reason=traceback.format_exc().splitlines()[-1])
+            results.append(result)
+            if verbose:
+               print(format_result(result))
+   finally:
+      shutil.rmtree(workdir, ignore_errors=True)
+
+   machine = dict(platform=platform.platform(), python=platform.python_version(),
+                  numpy=np.__version__, processor=platform.processor())
+   try:
+      import resource
+      machine['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   except ImportError:
+      pass
+
+   return dict(version=RESULTS_VERSION, created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+               machine=machine, results=results, scaling=scaling(results))
+
+def compare(results, baseline, threshold=1.2):
+   """
+   Compare results with a baseline, adds the ratio to the baseline time to
+   every result that is in both.
+
+   A benchmark that ran in the baseline but now fails or is skipped counts as
+   a regression as well.
+
+   :return: list of the results that are slower than threshold times the
+            baseline, or that are no longer ok
+   """
+   reference = dict([((r['name'], r['size']), r) for r in baseline['results']
+                     if r['status'] == 'ok'])
+
+   regressions = []
+   for r in results['results']:
+      ref = reference.get((r['name'], r['size']))
+      if ref is None:
+         continue
+      if r['status'] != 'ok':
+         regressions.append(r)
+         continue
+      r['ratio'] = r['time'] / ref['time']
+      if r['ratio'] > threshold:
+         regressions.append(r)
+   return regressions
+
+def format_result(r):
+   """
+   One line summary of a result.
+   """
+   line = '%-22s %10s  ' % (r['name'], r['size'])
+   if r['status'] != 'ok':
+      return line + '%s (%s)' % (r['status'], r.get('reason', ''))
+
+   line += '%10.4f s  %12.4g /s' % (r['time'], r['throughput'])
+   if r.get('peak_memory') is not None:
+      line += '  %9.1f MB' % (r['peak_memory'] / 1e6)
+   if 'ratio' in r:
+      line += '  x%0.2f' % r['ratio']
+   return line
+
+def main(argv=None):
+   import argparse
+
+   parser = argparse.ArgumentParser(description="""
+   Benchmark the numerical hot paths of the sdB manual scripts.
+   """)
+   parser.add_argument("-o", type=str, dest='output', default=None,
+                     help="JSON file to write the results to")
+   parser.add_argument("-baseline", type=str, dest='baseline', default=None,
+                     help="JSON results file to compare with")
+   parser.add_argument("-only", type=str, nargs='+', dest='only', default=None,
+                     help="Names or patterns of the benchmarks to run (fx. 'pixgrid.*')")
+   parser.add_argument("-quick", action='store_true', dest='quick',
+                     help="Only run the two smallest sizes of every benchmark")
+   parser.add_argument("-maxtime", type=float, dest='maxtime', default=10.,
+                     help="Maximum time in seconds to repeat one measurement (default=10)")
+   parser.add_argument("-threshold", type=float, dest='threshold', default=1.2,
+                     help="Slowdown compared to the baseline that counts as regression (default=1.2)")
+   args = parser.parse_args(argv)
+
+   results = run(names=args.only, quick=args.quick, maxtime=args.maxtime)
+
+   print('')
+   for name, exponent in sorted(results['scaling'].items()):
+      print('%-22s scales as size^%0.2f' % (name, exponent))
+
+   regressions = []
+   if args.baseline is not None:
+      with open(args.baseline) as fh:
+         regressions = compare(results, json.load(fh), threshold=args.threshold)
+
+      print('\nCompared with %s:' % args.baseline)
+      for r in results['results']:
+         if 'ratio' in r:
+            print(format_result(r))
+      for r in regressions:
+         if r['status'] != 'ok':
+            print('REGRESSION: %s size %s is %s (%s)' % (r['name'], r['size'], r['status'],
+                                                       r.get('reason', '')))
+         else:
+            print('REGRESSION: %s size %s is %0.2f times slower' % (r['name'], r['size'], r['ratio']))
+
+   if args.output is not None:
+      with open(args.output, 'w') as fh:
+         json.dump(results, fh, indent=1)
+
+   return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
@@ -0,0 +1,47 @@
+import numpy as np
+
+#-- Equivalent of 1 A.U/yr in km/s
+k = 4.74047
+
+#-- transformation matrix from equatorial to galactic coordinates
+A_G = np.array( [ [ 0.0548755604, +0.4941094279, -0.8676661490],
+                  [ 0.8734370902, -0.4448296300, -0.1980763734],
+                  [ 0.4838350155,  0.7469822445, +0.4559837762] ]).T
+
+def uvw(ra, dec, pmra, pmdec, d, vrad):
+   """
+   Calculate the U, V, W space velocities (km/s) with respect to the Sun,
+   following Johnson & Soderblom 1987. All parameters can be floats or arrays.
+
+   :parameter array ra: right ascension in degrees
+   :parameter array dec: declination in degrees
+   :parameter array pmra: proper motion in RA in mas/yr
+   :parameter array pmdec: proper motion in Dec in mas/yr
+   :parameter array d: distance in parsec
+   :parameter array vrad: radial velocity in km/s
+   :return: (U, V, W), U is positive towards the Galactic center
+   """
+   plx = 1e3 / d # parallax in mas
+
+   cosd = np.cos(np.radians(dec))
+   sind = np.sin(np.radians(dec))
+   cosa = np.cos(np.radians(ra))
+   sina = np.sin(np.radians(ra))
+
+   vec1 = vrad
+   vec2 = k * pmra / plx
+   vec3 = k * pmdec / plx
+
+   u = ( A_G[0,0]*cosa*cosd+A_G[0,1]*sina*cosd+A_G[0,2]*sind)*vec1+ \
+      (-A_G[0,0]*sina     +A_G[0,1]*cosa                   )*vec2+ \
+      (-A_G[0,0]*cosa*sind-A_G[0,1]*sina*sind+A_G[0,2]*cosd)*vec3
+   v = ( A_G[1,0]*cosa*cosd+A_G[1,1]*sina*cosd+A_G[1,2]*sind)*vec1+ \
+      (-A_G[1,0]*sina     +A_G[1,1]*cosa                   )*vec2+ \
+      (-A_G[1,0]*cosa*sind-A_G[1,1]*sina*sind+A_G[1,2]*cosd)*vec3
+   w = ( A_G[2,0]*cosa*cosd+A_G[2,1]*sina*cosd+A_G[2,2]*sind)*vec1+ \
+      (-A_G[2,0]*sina     +A_G[2,1]*cosa                   )*vec2+ \
+      (-A_G[2,0]*cosa*sind-A_G[2,1]*sina*sind+A_G[2,2]*cosd)*vec3
+
+   u = -u # U in Johnson & Soderblom is defined as positive outwards, so we switch here.
+
+   return u, v, w
@@ -1,3 +1,5 @@
+from __future__ import print_function
+
 import numpy as np
 from ivs.units import constants, conversions
 
@@ -71,7 +73,7 @@ if __name__ == "__main__":
     
     logg, el, eu = calc_gr_mc(loggms, M1, M2, dv, n)
     
-    print 'logg sdB: %0.3f - %0.3f + %0.3f'%(logg, el, eu)
+    print('logg sdB: %0.3f - %0.3f + %0.3f'%(logg, el, eu))
 
 
     
@@ -1,4 +1,6 @@
  
+from __future__ import print_function
+
 import pyfits
 
 import numpy as np
@@ -28,28 +30,9 @@ obsfile = 'observed_2MASS.dat' # file to save/load observed data
 synfile = 'synthetic_2MASS.dat' # file to save/load synthetic data
 
 #===================================================================================
-# Get all necessary data
+# Synthetic and observed photometry
 #===================================================================================
 
-#-- Get the reference flux
-if reference == 'VEGA':
-   #-- calculate Flam based on the Vega spectrum
-   hdu = pyfits.open('alpha_lyr_stis_008.fits')
-   wave, flux = hdu[1].data['wavelength'], hdu[1].data['flux']
-   hdu.close()
-
-else:
-   #-- calculate Flam for the AB system
-   wave = np.arange(3000, 9000, step=0.5)
-   flux = cv.convert(cc.cc_units, 'AA/s', cc.cc) / wave**2 * 3631e-23
-
-Flam_0 = model.synthetic_flux(wave,flux,photbands=photbands)
-
-
-#-- load the calibrators
-calibrators = ascii.read2array(basedir+'calspec.ident', splitchar=',', dtype=str)
-
-
 def get_synthetic_photometry(calibrator):
    """
    Integrate the spectrum belonging to this calibrator and return the synthetic magnitudes
@@ -103,93 +86,42 @@ def get_observed_photometry(calibrator):
       
    return np.array(photometry), np.array(error)
 
-if calculate:
-   #-- run over all calibrators and get synthetic and observed magnitudes
-   synthetic = []
-   observed = []
-   for i, calibrator in enumerate(calibrators):
-      
-      print i+1, '/', len(calibrators)
-      
-      syn = get_synthetic_photometry(calibrator)
-      
-      #-- skip calibrator if synthetic photometry can't be computed
-      if len(syn) == 0:
-         #print 'fail'
-         continue
-      
-      obs, err= get_observed_photometry(calibrator)
-      
-      #-- skip calibrator is no photometry is available
-      if len(obs) == 0:
-         #print 'fail'
-         continue
-      
-      syn = [calibrator[0]] + list(syn)
-      obs = [calibrator[0]] + list(obs) +list(err)
-      
-      synthetic.append(tuple(syn))
-      observed.append(tuple(obs))
+#===================================================================================
+# Zero point calculation and plotting
+#===================================================================================
 
-   #-- store in easy to use recarrays
-   dtype = [('name', 'a20')] + [(pb.split('.')[-1] , 'f8') for pb in photbands]
-   synthetic = np.array(synthetic, dtype=dtype)
+def mc(color, syn, obs, err):
+   """
+   Use MC simulation to get zero points and error
+   """
+   zp, slope = [], []
+   for i in range(1024):
+      #-- add normal noise comparable with error
+      obs_ = err * np.random.normal(len(obs)) + obs
 
-   dtype = [('name', 'a20')] + [(pb.split('.')[-1] , 'f8') for pb in photbands] +\
-         [('e_'+pb.split('.')[-1] , 'f8') for pb in photbands]
-   observed = np.array(observed, dtype=dtype)
+      #-- calculate zp
+      zp.append( np.average( syn - obs_ , weights=1./err ) )
 
-   #-- write results to file
-   ascii.write_array(synthetic, synfile, sep=',')
-   ascii.write_array(observed, obsfile, sep=',')
-   
-else:
-   #-- load results from file
-   dtype = [('name', 'a20')] + [(pb.split('.')[-1] , 'f8') for pb in photbands]
-   synthetic = ascii.read2recarray(synfile, splitchar=',', dtype=dtype)
-   dtype = [('name', 'a20')] + [(pb.split('.')[-1] , 'f8') for pb in photbands] +\
-         [('e_'+pb.split('.')[-1] , 'f8') for pb in photbands]
-   observed = ascii.read2recarray(obsfile, splitchar=',', dtype=dtype)
+      #-- calculate the slope
+      coef = np.polyfit(color, syn - obs_, 1, w=1./err)
+      slope.append(coef[0])
 
+   #-- error and exact value for zp
+   e_zp = np.std(zp)
+   zp = np.average( syn - obs , weights=1./err )
 
-#-- add some minimal error is non is given observationaly
-for band in ['e_'+pb.split('.')[-1] for pb in photbands]:
-   observed[band] = np.where(observed[band]<=minerror, minerror, observed[band])
+   #-- error and exact value for slope
+   coef = np.polyfit(color, syn - obs , 1, w=1./err)
+   e_slope = np.std(slope)
+   slope = coef[0]
 
-#===================================================================================
-# Zero point calculation and plotting
-#===================================================================================
+   return zp, e_zp, slope, e_slope
 
 def fit_zp(ax, band, c1, c2):
    """
    Get the zeropoint and plot the results
    """
    
-   def mc(color, syn, obs, err):
-      #-- Use MC simulation to get zero points and error
-      zp, slope = [], []
-      for i in range(1024):
-         #-- add normal noise comparable with error
-         obs_ = err * np.random.normal(len(obs)) + obs
-         
-         #-- calculate zp
-         zp.append( np.average( syn - obs_ , weights=1./err ) )
-         
-         #-- calculate the slope
-         coef = np.polyfit(color, syn - obs_, 1, w=1./err)
-         slope.append(coef[0])
-      
-      #-- error and exact value for zp
-      e_zp = np.std(zp)
-      zp = np.average( syn - obs , weights=1./err )
-      
-      #-- error and exact value for slope
-      coef = np.polyfit(color, syn - obs , 1, w=1./err)
-      e_slope = np.std(slope)
-      slope = coef[0]
-      
-      return zp, e_zp, slope, e_slope
-   
    #-- Get the zero point and slope
    color = synthetic[c1]-synthetic[c2]
    
@@ -244,11 +176,85 @@ def fit_zp(ax, band, c1, c2):
    pl.title("{} : Zp = {:0.3f} +- {:0.3f}".format(band, zp, e_zp))
 
 
+if __name__ == "__main__":
+
+   #-- Get the reference flux
+   if reference == 'VEGA':
+      #-- calculate Flam based on the Vega spectrum
+      hdu = pyfits.open('alpha_lyr_stis_008.fits')
+      wave, flux = hdu[1].data['wavelength'], hdu[1].data['flux']
+      hdu.close()
+
+   else:
+      #-- calculate Flam for the AB system
+      wave = np.arange(3000, 9000, step=0.5)
+      flux = cv.convert(cc.cc_units, 'AA/s', cc.cc) / wave**2 * 3631e-23
+
+   Flam_0 = model.synthetic_flux(wave,flux,photbands=photbands)
+
+
+   #-- load the calibrators
+   calibrators = ascii.read2array(basedir+'calspec.ident', splitchar=',', dtype=str)
+
 
-pl.figure(1, figsize=(12, 5))
-bands = [pb.split('.')[-1]  for pb in photbands]
-for i, b in enumerate(bands):
-   ax = pl.subplot(1, len(bands), i+1)
-   fit_zp(ax, b, c1, c2)
-pl.tight_layout()
-pl.show()
\ No newline at end of file
+   if calculate:
+      #-- run over all calibrators and get synthetic and observed magnitudes
+      synthetic = []
+      observed = []
+      for i, calibrator in enumerate(calibrators):
+      
+         print(i+1, '/', len(calibrators))
+      
+         syn = get_synthetic_photometry(calibrator)
+      
+         #-- skip calibrator if synthetic photometry can't be computed
+         if len(syn) == 0:
+            #print 'fail'
+            continue
+      
+         obs, err= get_observed_photometry(calibrator)
+      
+         #-- skip calibrator is no photometry is available
+         if len(obs) == 0:
+            #print 'fail'
+            continue
+      
+         syn = [calibrator[0]] + list(syn)
+         obs = [calibrator[0]] + list(obs) +list(err)
+      
+         synthetic.append(tuple(syn))
+         observed.append(tuple(obs))
+
+      #-- store in easy to use recarrays
+      dtype = [('name', 'a20')] + [(pb.split('.')[-1] , 'f8') for pb in photbands]
+      synthetic = np.array(synthetic, dtype=dtype)
+
+      dtype = [('name', 'a20')] + [(pb.split('.')[-1] , 'f8') for pb in photbands] +\
+            [('e_'+pb.split('.')[-1] , 'f8') for pb in photbands]
+      observed = np.array(observed, dtype=dtype)
+
+      #-- write results to file
+      ascii.write_array(synthetic, synfile, sep=',')
+      ascii.write_array(observed, obsfile, sep=',')
+   
+   else:
+      #-- load results from file
+      dtype = [('name', 'a20')] + [(pb.split('.')[-1] , 'f8') for pb in photbands]
+      synthetic = ascii.read2recarray(synfile, splitchar=',', dtype=dtype)
+      dtype = [('name', 'a20')] + [(pb.split('.')[-1] , 'f8') for pb in photbands] +\
+            [('e_'+pb.split('.')[-1] , 'f8') for pb in photbands]
+      observed = ascii.read2recarray(obsfile, splitchar=',', dtype=dtype)
+
+
+   #-- add some minimal error is non is given observationaly
+   for band in ['e_'+pb.split('.')[-1] for pb in photbands]:
+      observed[band] = np.where(observed[band]<=minerror, minerror, observed[band])
+
+   #-- fit and plot the zero point of every band
+   pl.figure(1, figsize=(12, 5))
+   bands = [pb.split('.')[-1]  for pb in photbands]
+   for i, b in enumerate(bands):
+      ax = pl.subplot(1, len(bands), i+1)
+      fit_zp(ax, b, c1, c2)
+   pl.tight_layout()
+   pl.show()
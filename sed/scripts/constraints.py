@@ -0,0 +1,120 @@
+"""
+Vectorized evaluation of constraints in binary SED fits.
+
+All derived quantities are calculated at once for the whole array of models
+returned by a batched grid lookup (fx. pixgrid.get_itable_pix_multiple), and
+every constraint adds its chi2 term in one array operation.
+
+>>> flux, Labs, cflux, cLabs = pixgrid.get_itable_pix_multiple(**pars)
+>>> chi2, derived = evaluate({'q': (0.56, 0.03), 'dgamma': (1.34, 0.51)},
+...                          Labs1=cLabs[0], Labs2=cLabs[1], **pars)
+"""
+
+import numpy as np
+from ivs.units import constants, conversions
+
+#-- conversion factors, calculated once
+_Rsol_cm = conversions.convert('Rsol', 'cm', 1.)
+_Rsol_pc = conversions.convert('Rsol', 'pc', 1.)
+_cms_kms = conversions.convert('cm s-1', 'km s-1', 1.)
+
+
+#===================================================================================
+# Derived quantities
+#===================================================================================
+
+def mass_ratio(rad1, logg1, rad2, logg2):
+   """
+   Mass ratio q = M2 / M1 = R2^2 g2 / (R1^2 g1)
+   """
+   return (np.asarray(rad2)**2 * 10**np.asarray(logg2, float)) / \
+          (np.asarray(rad1)**2 * 10**np.asarray(logg1, float))
+
+def luminosity_ratio(Labs1, Labs2):
+   """
+   Luminosity ratio L2 / L1
+   """
+   return np.asarray(Labs2, float) / np.asarray(Labs1, float)
+
+def gravitational_redshift(rad, logg):
+   """
+   Gravitational redshift in km/s of a star with radius rad (Rsol) and surface
+   gravity logg (cgs): z_g = sqrt(G M g) / c = R g / c
+   """
+   zg = np.asarray(rad) * _Rsol_cm * 10**np.asarray(logg, float) / constants.cc_cgs
+   return zg * _cms_kms
+
+def delta_gamma(rad1, logg1, rad2, logg2):
+   """
+   Difference in system velocity (km/s) between component 1 and 2 caused by
+   gravitational redshift, see Zg2logg.calc_gr for the inverse problem.
+   """
+   return gravitational_redshift(rad1, logg1) - gravitational_redshift(rad2, logg2)
+
+def distance(rad1, scale):
+   """
+   Distance in pc following from the radius of the first component (Rsol) and
+   the SED scale factor (R/d)^2
+   """
+   return np.asarray(rad1) / np.sqrt(np.asarray(scale, float)) * _Rsol_pc
+
+
+#-- name of the constraint: (function, names of the parameters it needs)
+CONSTRAINTS = {
+   'q': (mass_ratio, ['rad1', 'logg1', 'rad2', 'logg2']),
+   'lr': (luminosity_ratio, ['Labs1', 'Labs2']),
+   'dgamma': (delta_gamma, ['rad1', 'logg1', 'rad2', 'logg2']),
+   'distance': (distance, ['rad1', 'scale']),
+}
+
+
+#===================================================================================
+# Chi2 evaluation
+#===================================================================================
+
+def chi2(model, value, error):
+   """
+   Chi2 term of a constraint. error can be a float or a (lower, upper) tuple
+   for asymmetric errors.
+   """
+   model = np.asarray(model, float)
+   if np.ndim(error) == 1:
+      error = np.where(model < value, error[0], error[1])
+   return ((model - value) / error)**2
+
+def derive(names, **pars):
+   """
+   Calculate derived quantities for all models at once.
+
+   :parameter list names: names of the derived quantities (see CONSTRAINTS)
+   :return: dict with an array for every derived quantity
+   """
+   derived = {}
+   for name in names:
+      if not name in CONSTRAINTS:
+         raise ValueError('Unknown constraint: %s, available: %s' % (name,
+                           ', '.join(sorted(CONSTRAINTS.keys()))))
+      func, args = CONSTRAINTS[name]
+      missing = [a for a in args if not a in pars]
+      if missing:
+         raise ValueError('Constraint %s requires: %s' % (name, ', '.join(missing)))
+      derived[name] = func(*[pars[a] for a in args])
+   return derived
+
+def evaluate(constraints, **pars):
+   """
+   Evaluate a set of constraints for an array of models.
+
+   :parameter dict constraints: name: (value, error) for each constraint
+   :parameter pars: model parameters as arrays (rad1, logg1, rad2, logg2, Labs1,
+                    Labs2, scale, ...)
+   :return: (chi2, derived) where chi2 is the summed chi2 of all constraints for
+            each model, and derived a dict with the derived quantities
+   """
+   derived = derive(list(constraints.keys()), **pars)
+
+   total = 0.
+   for name, (value, error) in constraints.items():
+      total = total + chi2(derived[name], value, error)
+
+   return total, derived
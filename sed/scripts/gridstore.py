@@ -0,0 +1,241 @@
+"""
+Binary, column oriented storage for integrated grids.
+
+A grid store is a directory with one .npy file per column and a meta.json
+file describing the columns. Columns can be memory-mapped individually, and
+adding photbands to a grid only writes the new columns instead of rewriting
+the whole grid.
+
+   mygrid.igrid/
+      meta.json
+      teff.npy
+      logg.npy
+      ebv.npy
+      labs.npy
+      GALEX.FUV.npy
+      ...
+
+Existing integrated grids in FITS format (ASCII or binary tables) can be
+converted without loss of precision with convert_fits. ASCII tables are parsed
+directly from the text in the file into float64, instead of through the float32
+columns that pyfits returns for E15.7 fields.
+
+>>> convert_fits('kurucz2_integrated.fits', 'kurucz2_integrated.igrid')
+>>> columns, meta = open_store('kurucz2_integrated.igrid')
+"""
+
+import os
+import re
+import json
+
+import numpy as np
+import pyfits
+
+STORE_VERSION = 1
+
+
+def is_store(path):
+   """
+   Check if path is a grid store.
+   """
+   return os.path.isfile(os.path.join(path, 'meta.json'))
+
+def read_meta(path):
+   """
+   Read the meta data of a grid store.
+   """
+   with open(os.path.join(path, 'meta.json')) as fh:
+      return json.load(fh)
+
+def _write_meta(path, meta):
+   """
+   Replace meta.json in one atomic step, it is the last file to be written
+   so that readers never see columns that are not complete.
+   """
+   fname = os.path.join(path, 'meta.json')
+   tmpname = fname + '.%i.tmp' % os.getpid()
+   with open(tmpname, 'w') as fh:
+      json.dump(meta, fh, indent=1)
+   os.rename(tmpname, fname)
+
+def _write_column(path, name, values):
+   fname = os.path.join(path, name + '.npy')
+   tmpname = fname + '.%i.tmp' % os.getpid()
+   with open(tmpname, 'wb') as fh:
+      np.save(fh, np.ascontiguousarray(values))
+   os.rename(tmpname, fname)
+
+def create(path, columns, names=None, **meta):
+   """
+   Create a new grid store, overwriting an existing one.
+
+   :parameter str path: directory of the store
+   :parameter dict columns: name: array for every column, all of the same length
+   :parameter list names: order of the columns (default sorted)
+   :parameter meta: extra meta data to store (fx. law, Rv)
+   """
+   if names is None:
+      names = sorted(columns.keys())
+
+   nrows = set([len(columns[n]) for n in names])
+   if len(nrows) > 1:
+      raise ValueError('All columns of a grid store need to have the same length')
+
+   if not os.path.isdir(path):
+      os.makedirs(path)
+   elif is_store(path):
+      os.remove(os.path.join(path, 'meta.json'))
+
+   for name in names:
+      _write_column(path, name, columns[name])
+
+   meta.update(dict(version=STORE_VERSION, nrows=nrows.pop() if nrows else 0,
+                    columns=list(names)))
+   _write_meta(path, meta)
+
+def append_columns(path, columns, names=None):
+   """
+   Add columns to an existing grid store. Existing columns with the same name
+   are replaced, all other columns are left untouched.
+
+   :parameter str path: directory of the store
+   :parameter dict columns: name: array for every new column
+   :parameter list names: order of the new columns (default sorted)
+   """
+   if names is None:
+      names = sorted(columns.keys())
+
+   meta = read_meta(path)
+   for name in names:
+      if len(columns[name]) != meta['nrows']:
+         raise ValueError('Column %s has %i rows, the store has %i' % (name,
+                           len(columns[name]), meta['nrows']))
+
+   for name in names:
+      _write_column(path, name, columns[name])
+      if not name in meta['columns']:
+         meta['columns'].append(name)
+
+   _write_meta(path, meta)
+
+def read_column(path, name, mmap=True):
+   """
+   Read (memory-map) one column of a grid store.
+   """
+   return np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+
+def open_store(path, names=None, mmap=True):
+   """
+   Open a grid store.
+
+   :parameter str path: directory of the store
+   :parameter list names: the columns to load (default all)
+   :parameter bool mmap: memory-map the columns instead of reading them
+   :return: (columns, meta) with columns a dict of arrays
+   """
+   meta = read_meta(path)
+   if names is None:
+      names = meta['columns']
+
+   missing = [n for n in names if not n in meta['columns']]
+   if missing:
+      raise ValueError('Columns not available in grid store: %s' % ', '.join(missing))
+
+   return dict([(n, read_column(path, n, mmap=mmap)) for n in names]), meta
+
+
+#===================================================================================
+# Conversion from FITS integrated grids
+#===================================================================================
+
+#-- header keywords that describe the table structure, not the grid
+_STRUCTURAL = re.compile(r'^(XTENSION|BITPIX|NAXIS\d*|PCOUNT|GCOUNT|TFIELDS|EXTNAME|'
+                         r'(TTYPE|TFORM|TBCOL|TUNIT|TNULL|TDIM|TSCAL|TZERO|TDISP)\d+)$')
+
+def _read_ascii_table(fitsfile, ext, header):
+   """
+   Parse the columns of a FITS ASCII table directly from the text in the file.
+   """
+   hdu = pyfits.open(fitsfile)
+   datloc = hdu.fileinfo(ext)['datLoc']
+   hdu.close()
+
+   width, nrows = header['NAXIS1'], header['NAXIS2']
+   raw = np.memmap(fitsfile, dtype='S1', mode='r', offset=datloc, shape=(nrows, width))
+
+   names, columns = [], {}
+   for i in range(1, header['TFIELDS'] + 1):
+      name = header['TTYPE%i' % i].strip()
+      start = header['TBCOL%i' % i] - 1
+      form = header['TFORM%i' % i].strip()
+      fwidth = int(re.match(r'[A-Z](\d+)', form).group(1))
+
+      text = raw[:, start:start + fwidth].copy().view('S%i' % fwidth).ravel()
+      if form[0] in 'EDF':
+         values = np.char.replace(text, b'D', b'E').astype(np.float64)
+      elif form[0] == 'I':
+         values = text.astype(np.int64)
+      else:
+         values = np.char.strip(text)
+
+      names.append(name)
+      columns[name] = values
+
+   return names, columns
+
+def convert_fits(fitsfile, path=None, dtype=None, ext=1):
+   """
+   Convert an integrated grid in FITS format to a grid store.
+
+   With the default dtype the conversion is lossless: ASCII columns are parsed
+   to float64, binary columns keep their type. Use dtype='f4' to store all
+   float columns as float32, which halves the size of the store.
+
+   The non structural header keywords (fx. Z, law, Rv) are stored in the meta
+   data under 'header'.
+
+   :parameter str fitsfile: the integrated grid to convert
+   :parameter str path: the grid store to create (default fitsfile with .igrid extension)
+   :parameter str dtype: float type of the stored columns (default lossless)
+   :parameter int ext: the extension containing the grid
+   :return: the path of the grid store
+   """
+   if path is None:
+      path = os.path.splitext(fitsfile)[0] + '.igrid'
+
+   header = pyfits.getheader(fitsfile, ext)
+
+   if header['XTENSION'].strip() == 'TABLE':
+      names, columns = _read_ascii_table(fitsfile, ext, header)
+   else:
+      data = pyfits.getdata(fitsfile, ext)
+      names = list(data.columns.names)
+      columns = dict([(n, np.array(data.field(n))) for n in names])
+
+   if dtype is not None:
+      for name in names:
+         if columns[name].dtype.kind == 'f':
+            columns[name] = columns[name].astype(dtype)
+
+   cards = dict([(k, header[k]) for k in header.keys() if k and not _STRUCTURAL.match(k)
+                 and isinstance(header[k], (str, int, float, bool))])
+
+   create(path, columns, names=names, source=os.path.basename(fitsfile), header=cards)
+
+   return path
+
+
+if __name__ == "__main__":
+   import argparse
+
+   parser = argparse.ArgumentParser(description="""
+   Convert integrated grids in FITS format to binary grid stores.
+   """)
+   parser.add_argument("fitsfiles", type=str, nargs='+',
+                     help="The integrated grid file(s) to convert")
+   parser.add_argument("-dtype", type=str, dest='dtype', default=None,
+                     help="Float type of the stored columns (default lossless)")
+   args = parser.parse_args()
+
+   for fitsfile in args.fitsfiles:
+      print('%s -> %s' % (fitsfile, convert_fits(fitsfile, dtype=args.dtype)))
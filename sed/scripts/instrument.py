@@ -0,0 +1,443 @@
+"""
+Lightweight, opt-in timing and memory instrumentation.
+
+Stages of the scripts are marked as named spans, either with the decorator or
+as a context manager:
+
+>>> @instrumented('zeropoints.mc')
+... def mc(color, syn, obs, err):
+...    ...
+
+>>> with span('grid.load', grid=gridname):
+...    ...
+
+and quantities are counted with count('pixgrid.models', n). When the
+instrumentation is disabled (the default) a span is a single flag check, and
+nothing is recorded.
+
+The easiest way to profile a complete run is to start the script through this
+module. It enables the instrumentation, wraps the hot library functions
+(FITS loading, synthetic photometry, grid interpolation, photometry loading and
+matplotlib redraws) and the stages of the scripts of this manual listed in
+SCRIPT_FUNCTIONS, and writes a summary table and a Chrome trace (open in
+chrome://tracing or https://ui.perfetto.dev) when the script ends:
+
+   python instrument.py -trace run.json -summary run.txt calculate_zeropoints.py
+
+The scripts themselves do not depend on this module. Only the modules next to
+it in sed/scripts (pixgrid.py, integrate_grid.py) mark spans in their code, and
+need this module next to them.
+
+Spans in worker processes of a multiprocessing pool are not recorded.
+"""
+
+import os
+import ast
+import sys
+import json
+import types
+import time
+import threading
+import functools
+
+try:
+   import resource
+except ImportError:
+   resource = None
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+#-- library functions that are wrapped by enable(patch=True): (module, attribute, span name)
+HOT_FUNCTIONS = [
+   ('pyfits', 'open', 'fits.open'),
+   ('pyfits', 'getdata', 'fits.getdata'),
+   ('pyfits', 'getheader', 'fits.getheader'),
+   ('ivs.sed.model', 'synthetic_flux', 'model.synthetic_flux'),
+   ('ivs.sed.model', 'get_table', 'model.get_table'),
+   ('ivs.sed.model', 'get_itable', 'model.get_itable'),
+   ('ivs.sed.model', 'get_itable_pix', 'model.get_itable_pix'),
+   ('ivs.sed.builder', 'SED.load_photometry', 'builder.SED.load_photometry'),
+   ('pylab', 'draw', 'matplotlib.draw'),
+]
+
+#-- functions of the scripts that are wrapped when the script is started through
+#   the runner: script name: [(attribute, span name)]
+SCRIPT_FUNCTIONS = {
+   'calculate_zeropoints.py': [
+      ('get_synthetic_photometry', 'zeropoints.synthetic_photometry'),
+      ('get_observed_photometry', 'zeropoints.observed_photometry'),
+      ('fit_zp', 'zeropoints.fit_zp'),
+      ('mc', 'zeropoints.mc'),
+   ],
+   'Zg2logg.py': [
+      ('calc_gr_mc', 'zg2logg.calc_gr_mc'),
+   ],
+   'sfi.py': [
+      ('SFI.update_figure', 'sfi.update_figure'),
+      ('SFI.get_lines', 'sfi.get_lines'),
+   ],
+}
+
+
+class _State(object):
+   """
+   All recorded data of the current run.
+   """
+   def __init__(self):
+      self.enabled = False
+      self.max_events = 10**6
+      self.reset()
+
+   def reset(self):
+      self.t0 = _timer()
+      self.events = []      # (name, start, duration, thread id, args)
+      self.stats = {}       # name: [calls, total, max, peak rss]
+      self.counters = {}    # name: value
+      self.memory = []      # (time, rss in bytes)
+      self.patched = []     # (owner, attribute, original)
+      self.sampler = None
+
+_state = _State()
+
+
+#===================================================================================
+# Memory
+#===================================================================================
+
+def current_rss():
+   """
+   Current resident set size of the process in bytes (None if unknown).
+   """
+   try:
+      with open('/proc/self/statm') as fh:
+         return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+   except (IOError, OSError, ValueError):
+      return None
+
+def peak_rss():
+   """
+   Peak resident set size of the process in bytes (None if unknown).
+   """
+   if resource is None:
+      return None
+   peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   #-- linux reports kilobytes, macOS bytes
+   return peak if sys.platform == 'darwin' else peak * 1024
+
+class _Sampler(threading.Thread):
+   """
+   Background thread sampling the memory use of the process.
+   """
+   def __init__(self, interval):
+      threading.Thread.__init__(self)
+      self.daemon = True
+      self.interval = interval
+      self.stopped = threading.Event()
+
+   def run(self):
+      while not self.stopped.is_set():
+         rss = current_rss()
+         if rss is not None:
+            _state.memory.append((_timer(), rss))
+         self.stopped.wait(self.interval)
+
+
+#===================================================================================
+# Recording
+#===================================================================================
+
+def _record(name, start, duration, args):
+   stats = _state.stats.get(name)
+   if stats is None:
+      stats = _state.stats[name] = [0, 0., 0., 0]
+   stats[0] += 1
+   stats[1] += duration
+   stats[2] = max(stats[2], duration)
+   stats[3] = max(stats[3], peak_rss() or 0)
+
+   if len(_state.events) < _state.max_events:
+      _state.events.append((name, start, duration, threading.current_thread().ident, args))
+
+class span(object):
+   """
+   Context manager marking a named stage. Extra keyword arguments are stored
+   with the span in the trace.
+   """
+   __slots__ = ['name', 'args', 'start']
+
+   def __init__(self, name, **args):
+      self.name = name
+      self.args = args
+
+   def __enter__(self):
+      if _state.enabled:
+         self.start = _timer()
+      return self
+
+   def __exit__(self, *exc):
+      if _state.enabled:
+         end = _timer()
+         _record(self.name, self.start, end - self.start, self.args)
+      return False
+
+def instrumented(name):
+   """
+   Decorator marking a function as a named stage.
+   """
+   def decorator(func):
+      @functools.wraps(func)
+      def wrapper(*args, **kwargs):
+         if not _state.enabled:
+            return func(*args, **kwargs)
+         start = _timer()
+         try:
+            return func(*args, **kwargs)
+         finally:
+            _record(name, start, _timer() - start, None)
+      return wrapper
+   return decorator
+
+def count(name, n=1):
+   """
+   Add n to a named counter.
+   """
+   if _state.enabled:
+      _state.counters[name] = _state.counters.get(name, 0) + n
+
+
+#===================================================================================
+# Enable / disable
+#===================================================================================
+
+def _patch(modname, attribute, name):
+   """
+   Wrap a library function in a span, if the library is available.
+   """
+   try:
+      __import__(modname)
+   except ImportError:
+      return
+
+   _wrap(sys.modules[modname], attribute, name)
+
+def _wrap(owner, attribute, name):
+   """
+   Wrap the (dotted) attribute of an object in a span, if it exists.
+   """
+   parts = attribute.split('.')
+   for part in parts[:-1]:
+      owner = getattr(owner, part, None)
+      if owner is None:
+         return
+
+   original = getattr(owner, parts[-1], None)
+   if original is None:
+      return
+
+   setattr(owner, parts[-1], instrumented(name)(original))
+   _state.patched.append((owner, parts[-1], original))
+
+def enable(patch=False, sample_interval=None, max_events=10**6):
+   """
+   Start recording. Clears all previously recorded data.
+
+   :parameter bool patch: wrap the library functions in HOT_FUNCTIONS in spans
+   :parameter float sample_interval: sample the memory use every this many
+                                     seconds in a background thread (default off)
+   :parameter int max_events: maximum number of spans kept for the trace, the
+                              summary statistics include all spans
+   """
+   disable()
+   _state.reset()
+   _state.max_events = max_events
+
+   if patch:
+      for modname, attribute, name in HOT_FUNCTIONS:
+         _patch(modname, attribute, name)
+
+   if sample_interval:
+      _state.sampler = _Sampler(sample_interval)
+      _state.sampler.start()
+
+   _state.enabled = True
+
+def disable():
+   """
+   Stop recording and remove all library wrappers. Recorded data is kept.
+   """
+   _state.enabled = False
+
+   if _state.sampler is not None:
+      _state.sampler.stopped.set()
+      _state.sampler.join()
+      _state.sampler = None
+
+   for owner, attribute, original in reversed(_state.patched):
+      setattr(owner, attribute, original)
+   _state.patched = []
+
+def is_enabled():
+   return _state.enabled
+
+
+#===================================================================================
+# Export
+#===================================================================================
+
+def summary():
+   """
+   Summary of the recorded spans and counters.
+
+   :return: dict with per span: calls, total, mean and max time (s) and the peak
+            rss (bytes) seen at the end of the span; the counters; and the peak
+            rss of the process.
+   """
+   spans = {}
+   for name, (calls, total, tmax, peak) in _state.stats.items():
+      spans[name] = dict(calls=calls, total=total, mean=total / calls, max=tmax,
+                         peak_rss=peak)
+
+   return dict(spans=spans, counters=dict(_state.counters), peak_rss=peak_rss(),
+               wall_time=_timer() - _state.t0)
+
+def format_summary():
+   """
+   Summary as a table, sorted on total time.
+   """
+   s = summary()
+   lines = ['%-32s %8s %10s %10s %10s %10s' % ('span', 'calls', 'total s', 'mean ms',
+                                                'max ms', 'rss MB')]
+   for name, v in sorted(s['spans'].items(), key=lambda x: -x[1]['total']):
+      lines.append('%-32s %8i %10.3f %10.3f %10.3f %10.1f' % (name, v['calls'], v['total'],
+                   v['mean'] * 1e3, v['max'] * 1e3, (v['peak_rss'] or 0) / 1e6))
+
+   if s['counters']:
+      lines.append('')
+      lines.append('%-32s %8s' % ('counter', 'value'))
+      for name, value in sorted(s['counters'].items()):
+         lines.append('%-32s %8g' % (name, value))
+
+   lines.append('')
+   lines.append('wall time: %0.3f s   peak rss: %0.1f MB' % (s['wall_time'],
+                                                            (s['peak_rss'] or 0) / 1e6))
+   return '\n'.join(lines)
+
+def write_summary(filename):
+   """
+   Write the summary as a table (.txt) or as json (any other extension).
+   """
+   with open(filename, 'w') as fh:
+      if filename.endswith('.txt'):
+         fh.write(format_summary() + '\n')
+      else:
+         json.dump(summary(), fh, indent=1)
+
+def write_trace(filename):
+   """
+   Write the recorded spans and memory samples in the Chrome trace event format.
+   """
+   pid = os.getpid()
+   us = lambda t: (t - _state.t0) * 1e6
+
+   events = []
+   for name, start, duration, tid, args in _state.events:
+      event = dict(name=name, cat=name.split('.')[0], ph='X', ts=us(start),
+                   dur=duration * 1e6, pid=pid, tid=tid)
+      if args:
+         event['args'] = dict([(k, str(v)) for k, v in args.items()])
+      events.append(event)
+
+   for t, rss in _state.memory:
+      events.append(dict(name='rss', ph='C', ts=us(t), pid=pid, args=dict(MB=rss / 1e6)))
+
+   with open(filename, 'w') as fh:
+      json.dump(dict(traceEvents=events, displayTimeUnit='ms',
+                     otherData=dict(counters=dict(_state.counters))), fh)
+
+
+#===================================================================================
+# Runner
+#===================================================================================
+
+def _is_main_block(node):
+   """
+   True if the node is an if __name__ == "__main__": block
+   """
+   if not isinstance(node, ast.If) or not isinstance(node.test, ast.Compare):
+      return False
+   left, right = node.test.left, node.test.comparators[0]
+   value = getattr(right, 'value', getattr(right, 's', None))
+   return isinstance(left, ast.Name) and left.id == '__name__' and value == '__main__'
+
+def run_script(path, hooks=None):
+   """
+   Run a script as __main__, with the functions in hooks wrapped in spans.
+
+   The script is run in two steps: first everything outside its
+   if __name__ == "__main__": block, which defines the functions, and after
+   wrapping the functions the main block itself.
+
+   :parameter str path: the script
+   :parameter list hooks: (attribute, span name) of the functions to wrap
+   """
+   with open(path) as fh:
+      tree = ast.parse(fh.read(), path)
+   body = tree.body
+   main = [node for node in body if _is_main_block(node)]
+
+   module = types.ModuleType('__main__')
+   module.__file__ = path
+   saved = sys.modules['__main__']
+   sys.modules['__main__'] = module
+   try:
+      tree.body = [node for node in body if not _is_main_block(node)]
+      exec(compile(tree, path, 'exec'), module.__dict__)
+
+      for attribute, name in hooks or []:
+         _wrap(module, attribute, name)
+
+      tree.body = main
+      exec(compile(tree, path, 'exec'), module.__dict__)
+   finally:
+      sys.modules['__main__'] = saved
+
+def main(argv=None):
+   import argparse
+
+   parser = argparse.ArgumentParser(description="""
+   Run a script with instrumentation enabled, and write a summary and a Chrome
+   trace of where the time and memory went.
+   """)
+   parser.add_argument("-trace", type=str, dest='trace', default=None,
+                     help="Chrome trace json file to write")
+   parser.add_argument("-summary", type=str, dest='summary', default=None,
+                     help="Summary to write (.txt for a table, json otherwise)")
+   parser.add_argument("-interval", type=float, dest='interval', default=0.05,
+                     help="Memory sampling interval in seconds (default=0.05, 0 is off)")
+   parser.add_argument("script", type=str,
+                     help="The script to run")
+   parser.add_argument("arguments", nargs=argparse.REMAINDER,
+                     help="Arguments for the script")
+   args = parser.parse_args(argv)
+
+   #-- the script runs as if it was started directly
+   sys.argv = [args.script] + args.arguments
+   sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+
+   enable(patch=True, sample_interval=args.interval)
+   try:
+      run_script(args.script, SCRIPT_FUNCTIONS.get(os.path.basename(args.script)))
+   finally:
+      disable()
+      print(format_summary())
+      if args.summary is not None:
+         write_summary(args.summary)
+      if args.trace is not None:
+         write_trace(args.trace)
+
+
+if __name__ == "__main__":
+   #-- run through the imported module, so the script sees the same instance
+   sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+   import instrument
+   instrument.main()
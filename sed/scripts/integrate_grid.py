@@ -0,0 +1,362 @@
+"""
+Chunked, parallel and incremental integration of model grids.
+
+The integration is split in work units of (model chunk, E(B-V) chunk) that are
+distributed over all available cores. The result of every finished work unit is
+checkpointed to disk, so an interrupted integration continues where it
+stopped when called again. The integrated grid is written to a column
+oriented grid store (see gridstore.py), and adding photbands to an existing
+grid only integrates and writes the new bands.
+
+>>> model.set_defaults(grid='tmap')
+>>> store = calc_integrated_grid('tmap.igrid', ebvs=np.r_[0:0.5:0.02],
+...                              responses=['GALEX', 'APASS', '2MASS', 'WISE'])
+>>> update_grid(store, ['GAIA'])
+
+Alternatively the models can be integrated only once without reddening, together
+with a fit of the extinction in every band as a polynomial in E(B-V). The
+reddening can then be applied analytically for any E(B-V) at fit time, and the
+integrated grid is an order of magnitude smaller:
+
+>>> store = calc_extinction_grid('tmap_ext.igrid', responses=['GALEX', '2MASS'])
+"""
+
+import os
+import hashlib
+import shutil
+import multiprocessing
+
+import numpy as np
+import pyfits
+
+from ivs.sed import model, filters, reddening
+
+import gridstore
+from instrument import span, count
+
+
+def get_photbands(responses):
+   """
+   Expand a list of systems (fx. 'GALEX') and/or photbands to photbands.
+   """
+   photbands = []
+   for response in responses:
+      for pb in filters.list_response(response):
+         if not pb in photbands:
+            photbands.append(pb)
+   return photbands
+
+def get_model_parameters(gridfile):
+   """
+   Effective temperature and surface gravity of every model in a grid file.
+   """
+   hdu = pyfits.open(gridfile)
+   teffs = np.array([hdu[i].header['TEFF'] for i in range(1, len(hdu))], float)
+   loggs = np.array([hdu[i].header['LOGG'] for i in range(1, len(hdu))], float)
+   hdu.close()
+   return teffs, loggs
+
+def _integrate_unit(unit):
+   """
+   Integrate one work unit: a range of models for a set of E(B-V) values.
+   Runs in the worker processes.
+   """
+   gridfile, mstart, mend, ebvs, photbands, law, Rv = unit
+
+   rows = []
+   hdu = pyfits.open(gridfile)
+   for i in range(mstart, mend):
+      wave = hdu[i + 1].data.field('wavelength')
+      flux = hdu[i + 1].data.field('flux')
+      labs = model.luminosity(wave, flux)
+
+      for ebv in ebvs:
+         flux_ = reddening.redden(flux, wave=wave, ebv=ebv, rtype='flux', law=law, Rv=Rv)
+         rows.append([i, ebv, labs] + list(model.synthetic_flux(wave, flux_, photbands)))
+   hdu.close()
+
+   return np.array(rows, float).reshape(-1, 3 + len(photbands))
+
+def _make_units(gridfile, nmodels, ebvs, photbands, law, Rv, model_chunk, ebv_chunk):
+   units = []
+   for mstart in range(0, nmodels, model_chunk):
+      for estart in range(0, len(ebvs), ebv_chunk):
+         units.append((gridfile, mstart, min(mstart + model_chunk, nmodels),
+                       list(ebvs[estart:estart + ebv_chunk]), photbands, law, Rv))
+   return units
+
+def _unit_name(unit):
+   #-- everything that determines the result is hashed into the name, so a checkpoint
+   #   left by a run with other settings (grid, E(B-V) values, law, Rv, bands) is never reused
+   gridfile, mstart, mend, ebvs, photbands, law, Rv = unit
+   key = '|'.join([os.path.abspath(gridfile), '%i' % mstart, '%i' % mend,
+                   ','.join(['%r' % float(ebv) for ebv in ebvs]),
+                   ','.join(photbands), str(law), '%r' % float(Rv)])
+   return 'unit_%i_%i_%s.npy' % (mstart, mend, hashlib.sha1(key.encode()).hexdigest())
+
+def run_units(units, checkpoint, threads=None):
+   """
+   Integrate all work units in parallel, skipping units that are already
+   checkpointed.
+
+   :parameter list units: the work units
+   :parameter str checkpoint: directory for the checkpoint files
+   :parameter int threads: number of processes (default all cores)
+   :return: array with one row per (model, ebv): model index, ebv, labs, fluxes
+   """
+   if not os.path.isdir(checkpoint):
+      os.makedirs(checkpoint)
+
+   todo = [u for u in units if not os.path.isfile(os.path.join(checkpoint, _unit_name(u)))]
+
+   if threads is None:
+      threads = multiprocessing.cpu_count()
+
+   def _store(unit, result):
+      fname = os.path.join(checkpoint, _unit_name(unit))
+      np.save(fname + '.tmp.npy', result)
+      os.rename(fname + '.tmp.npy', fname)
+
+   count('integrate.units', len(todo))
+   count('integrate.units_checkpointed', len(units) - len(todo))
+
+   #-- the workers are not instrumented, only the total time is recorded
+   with span('integrate.run_units', units=len(todo), threads=threads):
+      if threads > 1 and len(todo) > 1:
+         pool = multiprocessing.Pool(threads)
+         try:
+            for unit, result in zip(todo, pool.imap(_integrate_unit, todo)):
+               _store(unit, result)
+         finally:
+            pool.close()
+            pool.join()
+      else:
+         for unit in todo:
+            _store(unit, _integrate_unit(unit))
+
+   return np.vstack([np.load(os.path.join(checkpoint, _unit_name(u))) for u in units])
+
+def calc_integrated_grid(store, gridfile=None, ebvs=None, responses=None, law='fitzpatrick2004',
+                         Rv=3.1, threads=None, model_chunk=50, ebv_chunk=5, update=True):
+   """
+   Integrate a model grid over a set of photbands and E(B-V) values.
+
+   If the grid store already exists and update is True, only photbands that are
+   not yet in the store are integrated and appended, using the E(B-V) values
+   of the store. Otherwise a new grid store is created.
+
+   :parameter str store: path of the grid store to write
+   :parameter str gridfile: model grid to integrate (default model.get_file())
+   :parameter array ebvs: E(B-V) values (default 0 to 0.5 in steps of 0.02)
+   :parameter list responses: systems and/or photbands to integrate
+   :parameter str law: reddening law
+   :parameter float Rv: Rv of the reddening law
+   :parameter int threads: number of processes (default all cores)
+   :parameter int model_chunk: number of models in one work unit
+   :parameter int ebv_chunk: number of E(B-V) values in one work unit
+   :parameter bool update: append to an existing store
+   :return: the path of the grid store
+   """
+   if gridfile is None:
+      gridfile = model.get_file()
+   if ebvs is None:
+      ebvs = np.r_[0:0.5:0.02]
+
+   if update and gridstore.is_store(store):
+      return update_grid(store, responses, gridfile=gridfile, threads=threads,
+                         model_chunk=model_chunk, ebv_chunk=ebv_chunk)
+
+   photbands = get_photbands(responses)
+   teffs, loggs = get_model_parameters(gridfile)
+   ebvs = np.asarray(ebvs, float)
+   checkpoint = store + '.partial'
+   units = _make_units(gridfile, len(teffs), ebvs, photbands, law, Rv, model_chunk, ebv_chunk)
+   result = run_units(units, checkpoint, threads=threads)
+
+   #-- rows ordered on model and then on ebv
+   result = result[np.lexsort((result[:, 1], result[:, 0]))]
+   mindex = result[:, 0].astype(int)
+
+   columns = dict(teff=teffs[mindex], logg=loggs[mindex], ebv=result[:, 1],
+                  labs=result[:, 2])
+   for i, pb in enumerate(photbands):
+      columns[pb] = result[:, 3 + i]
+
+   gridstore.create(store, columns, names=['teff', 'logg', 'ebv', 'labs'] + photbands,
+                    gridfile=os.path.basename(gridfile), law=law, Rv=Rv)
+   shutil.rmtree(checkpoint)
+
+   return store
+
+def update_grid(store, responses, gridfile=None, threads=None, model_chunk=50, ebv_chunk=5):
+   """
+   Add photbands to an existing grid store. Only bands that are not yet in the
+   store are integrated, for the same models and E(B-V) values as are already
+   present. Only the new columns are written.
+
+   :parameter str store: path of the grid store to extend
+   :parameter list responses: systems and/or photbands to add
+   :parameter str gridfile: model grid to integrate (default model.get_file())
+   :return: the path of the grid store
+   """
+   if gridfile is None:
+      gridfile = model.get_file()
+
+   if 'ext_order' in gridstore.read_meta(store):
+      return calc_extinction_grid(store, gridfile=gridfile, responses=responses,
+                                  threads=threads, model_chunk=model_chunk)
+
+   columns, meta = gridstore.open_store(store, names=['teff', 'logg', 'ebv'])
+   photbands = [pb for pb in get_photbands(responses) if not pb in meta['columns']]
+   if not photbands:
+      return store
+
+   ebvs = np.unique(columns['ebv'])
+   teffs, loggs = get_model_parameters(gridfile)
+
+   checkpoint = store + '.partial'
+   units = _make_units(gridfile, len(teffs), ebvs, photbands, meta.get('law', 'fitzpatrick2004'),
+                       meta.get('Rv', 3.1), model_chunk, ebv_chunk)
+   result = run_units(units, checkpoint, threads=threads)
+
+   #-- match the new rows on (teff, logg, ebv) of the rows in the store
+   def _keys(teff, logg, ebv):
+      return zip(np.round(teff, 2), np.round(logg, 4), np.round(ebv, 4))
+
+   mindex = result[:, 0].astype(int)
+   rows = dict([(k, i) for i, k in enumerate(_keys(teffs[mindex], loggs[mindex], result[:, 1]))])
+   index = np.array([rows.get(k, -1) for k in _keys(columns['teff'], columns['logg'],
+                                                     columns['ebv'])], int)
+
+   new = {}
+   for i, pb in enumerate(photbands):
+      new[pb] = np.where(index >= 0, result[index, 3 + i], np.nan)
+
+   gridstore.append_columns(store, new, names=photbands)
+   shutil.rmtree(checkpoint)
+
+   return store
+
+def fit_extinction(ebvs, fluxes, order=2):
+   """
+   Fit the extinction in every band as a polynomial in E(B-V) without constant
+   term: A(ebv) = c_1 ebv + c_2 ebv^2 + ... + c_order ebv^order (in magnitude)
+
+   :parameter array ebvs: the sampled E(B-V) values, the first one needs to be 0
+   :parameter array fluxes: (n_models x n_ebv x n_bands) reddened fluxes
+   :parameter int order: order of the polynomial
+   :return: (n_models x order x n_bands) array of coefficients
+   """
+   nmodels, nebv, nbands = fluxes.shape
+
+   with np.errstate(divide='ignore', invalid='ignore'):
+      A = -2.5 * np.log10(fluxes / fluxes[:, :1, :])
+   A = A.transpose(1, 0, 2).reshape(nebv, -1)
+
+   #-- fit all models and bands in one least squares solution
+   valid = np.all(np.isfinite(A), axis=0)
+   X = np.column_stack([np.asarray(ebvs, float)**k for k in range(1, order + 1)])
+   coef = np.empty((order, A.shape[1]))
+   coef[:] = np.nan
+   coef[:, valid] = np.linalg.lstsq(X, A[:, valid], rcond=-1)[0]
+
+   return coef.reshape(order, nmodels, nbands).transpose(1, 0, 2)
+
+def calc_extinction_grid(store, gridfile=None, responses=None, law='fitzpatrick2004', Rv=3.1,
+                         ebv_max=0.5, nsample=6, order=2, threads=None, model_chunk=50):
+   """
+   Integrate a model grid once without reddening, and store for every model and
+   band the coefficients of the extinction polynomial (see fit_extinction).
+
+   For every band the store contains the unreddened flux (column <band>) and
+   the coefficients (columns <band>__ext1 ... <band>__ext<order>). The reddened
+   flux for any E(B-V) is then: flux * 10**(-0.4 * A(ebv)).
+
+   If the store already exists, only the bands that are missing are integrated,
+   using the law, Rv and sampling of the store.
+
+   :parameter str store: path of the grid store to write or extend
+   :parameter str gridfile: model grid to integrate (default model.get_file())
+   :parameter list responses: systems and/or photbands to integrate
+   :parameter str law: reddening law
+   :parameter float Rv: Rv of the reddening law
+   :parameter float ebv_max: largest E(B-V) used in the fit of the extinction
+   :parameter int nsample: number of E(B-V) values between 0 and ebv_max to fit
+   :parameter int order: order of the extinction polynomial
+   :return: the path of the grid store
+   """
+   if gridfile is None:
+      gridfile = model.get_file()
+
+   photbands = get_photbands(responses)
+   teffs, loggs = get_model_parameters(gridfile)
+
+   exists = gridstore.is_store(store)
+   if exists:
+      meta = gridstore.read_meta(store)
+      if not 'ext_order' in meta:
+         raise ValueError('%s is not a continuous E(B-V) grid' % store)
+      law, Rv, ebv_max, nsample, order = meta['law'], meta['Rv'], meta['ebv_max'], \
+                                         meta['nsample'], meta['ext_order']
+      photbands = [pb for pb in photbands if not pb in meta['columns']]
+      if not photbands:
+         return store
+
+   ebvs = np.linspace(0, ebv_max, nsample)
+   checkpoint = store + '.partial'
+   units = _make_units(gridfile, len(teffs), ebvs, photbands, law, Rv, model_chunk, nsample)
+   result = run_units(units, checkpoint, threads=threads)
+
+   #-- rows ordered on model and then on ebv
+   result = result[np.lexsort((result[:, 1], result[:, 0]))]
+   fluxes = result[:, 3:].reshape(len(teffs), nsample, len(photbands))
+   coef = fit_extinction(ebvs, fluxes, order=order)
+
+   columns, names = {}, []
+   for i, pb in enumerate(photbands):
+      columns[pb] = fluxes[:, 0, i]
+      names.append(pb)
+      for k in range(order):
+         name = '%s__ext%i' % (pb, k + 1)
+         columns[name] = coef[:, k, i]
+         names.append(name)
+
+   if exists:
+      gridstore.append_columns(store, columns, names=names)
+   else:
+      columns.update(teff=teffs, logg=loggs, labs=result[::nsample, 2])
+      gridstore.create(store, columns, names=['teff', 'logg', 'labs'] + names,
+                       gridfile=os.path.basename(gridfile), law=law, Rv=Rv,
+                       ebv_max=ebv_max, nsample=nsample, ext_order=order)
+   shutil.rmtree(checkpoint)
+
+   return store
+
+
+if __name__ == "__main__":
+   import argparse
+
+   parser = argparse.ArgumentParser(description="""
+   Integrate a model grid over photometric pass bands, or add pass bands to an
+   already integrated grid. Interrupted runs continue from the last checkpoint.
+   """)
+   parser.add_argument("store", type=str,
+                     help="The grid store to create or extend")
+   parser.add_argument("responses", type=str, nargs='+',
+                     help="Photometric systems or bands to integrate")
+   parser.add_argument("-grid", type=str, dest='grid', default=None,
+                     help="Name of the model grid (default the model defaults)")
+   parser.add_argument("-threads", type=int, dest='threads', default=None,
+                     help="Number of processes to use (default all cores)")
+   parser.add_argument("-continuous", action='store_true', dest='continuous',
+                     help="Store extinction coefficients instead of an E(B-V) axis")
+   args = parser.parse_args()
+
+   if args.grid is not None:
+      model.set_defaults(grid=args.grid)
+
+   if args.continuous:
+      store = calc_extinction_grid(args.store, responses=args.responses, threads=args.threads)
+   else:
+      store = calc_integrated_grid(args.store, responses=args.responses, threads=args.threads)
+   print('Integrated grid written to %s' % store)
@@ -0,0 +1,114 @@
+"""
+Batched conversion between integrated fluxes and magnitudes.
+
+conversions.convert parses the units and looks up the zero point of the
+photband on every call. Here the reference flux (the flux of a 0 magnitude
+star in erg/s/cm2/AA) of every photband is looked up once and stored in a
+table, after which complete (n_models x n_bands) flux arrays are converted in
+one array operation.
+
+>>> table = get_zeropoint_table(photbands)
+>>> mags, e_mags = flux2mag(iflux.T, table=table, error=e_iflux.T)
+"""
+
+import numpy as np
+from ivs.units import conversions
+
+#-- photometric systems that are converted to AB magnitudes by default. All other
+#   bands use their native zero point ('native'), the one conversions.convert uses
+#   for 'mag': Vega for most systems, but fx. AB for SDSS.
+AB_SYSTEMS = ['GALEX']
+
+#-- magnitude unit of each system in conversions.convert
+SYSTEM_UNITS = {'AB': 'ABmag', 'native': 'mag'}
+
+#-- zero point tables already made in this process
+_tables = {}
+
+
+def get_zeropoint_table(photbands, systems=None):
+   """
+   Make the zero point table of a list of photbands.
+
+   The reference flux is calculated with conversions.convert, so the results
+   are identical to converting each band separately.
+
+   :parameter list photbands: the photbands
+   :parameter list systems: 'AB' or 'native' for each photband, by default AB
+                            for the systems in AB_SYSTEMS and native for all others
+   :return: record array with photband, system and flux0 (erg/s/cm2/AA)
+   """
+   if systems is None:
+      systems = ['AB' if pb.split('.')[0] in AB_SYSTEMS else 'native' for pb in photbands]
+
+   unknown = [system for system in systems if not system in SYSTEM_UNITS]
+   if unknown:
+      raise ValueError('Unknown photometric system(s): %s, use AB or native' % ', '.join(unknown))
+
+   key = (tuple(photbands), tuple(systems))
+   if key in _tables:
+      return _tables[key]
+
+   flux0 = [conversions.convert(SYSTEM_UNITS[system], 'erg/s/cm2/AA', 0., photband=pb)
+            for pb, system in zip(photbands, systems)]
+
+   table = np.rec.fromarrays([np.array(photbands), np.array(systems), np.array(flux0, float)],
+                             names=['photband', 'system', 'flux0'])
+   _tables[key] = table
+
+   return table
+
+def _reference(photbands, table, axis, ndim):
+   """
+   Reference fluxes shaped to broadcast along the band axis.
+   """
+   if table is None:
+      if photbands is None:
+         raise ValueError('Give the photbands or a zero point table')
+      table = get_zeropoint_table(photbands)
+
+   shape = [1] * ndim
+   shape[axis] = len(table)
+   return table['flux0'].reshape(shape)
+
+def flux2mag(flux, photbands=None, table=None, error=None, axis=-1):
+   """
+   Convert integrated fluxes (erg/s/cm2/AA) to magnitudes.
+
+   :parameter array flux: fluxes, the photbands along axis
+   :parameter list photbands: the photbands (not needed if table is given)
+   :parameter table: zero point table from get_zeropoint_table
+   :parameter array error: errors on the fluxes
+   :parameter int axis: the axis of flux along which the photbands are
+   :return: magnitudes, or (magnitudes, errors) if error is given
+   """
+   flux = np.asarray(flux, float)
+   flux0 = _reference(photbands, table, axis, flux.ndim)
+
+   mag = -2.5 * np.log10(flux / flux0)
+   if error is None:
+      return mag
+
+   e_mag = 2.5 / np.log(10) * np.asarray(error, float) / flux
+   return mag, e_mag
+
+def mag2flux(mag, photbands=None, table=None, error=None, axis=-1):
+   """
+   Convert magnitudes to integrated fluxes (erg/s/cm2/AA).
+
+   :parameter array mag: magnitudes, the photbands along axis
+   :parameter list photbands: the photbands (not needed if table is given)
+   :parameter table: zero point table from get_zeropoint_table
+   :parameter array error: errors on the magnitudes
+   :parameter int axis: the axis of mag along which the photbands are
+   :return: fluxes, or (fluxes, errors) if error is given
+   """
+   mag = np.asarray(mag, float)
+   flux0 = _reference(photbands, table, axis, mag.ndim)
+
+   flux = flux0 * 10**(-0.4 * mag)
+   if error is None:
+      return flux
+
+   e_flux = flux * np.log(10) / 2.5 * np.asarray(error, float)
+   return flux, e_flux
@@ -0,0 +1,549 @@
+"""
+Persistent, memory-mapped lookup index for integrated photometry grids.
+
+model.get_itable_pix loads every integrated grid file into memory and builds the
+marker array for the binary search on first use, and this is repeated in every
+new process. This module does that work once, stores the axis values and the
+reshaped (log10) flux cube in a cache directory next to the integrated grid, and
+memory-maps it on all subsequent uses. Workers of a parallel fit all map the
+same file and share its pages instead of each holding a private copy.
+
+The cache is rebuilt automatically when any of the source grid files changes
+(size or modification time).
+
+>>> iflux, Labs = get_itable_pix(teff=[6150, 5800], logg=[4.45, 4.35],
+...                              photbands=['2MASS.J', '2MASS.KS'], grid='kurucz2')
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import itertools
+
+import numpy as np
+import pyfits
+
+import gridstore
+from instrument import span, instrumented, count
+
+CACHE_VERSION = 1
+
+#-- parameter columns of an integrated grid, everything else is a photband
+AXES = ['teff', 'logg', 'ebv', 'z']
+PARAMETERS = AXES + ['rv', 'vrad', 'labs']
+
+#-- marks the extinction coefficient columns of a continuous E(B-V) grid
+EXT = '__ext'
+
+#-- pixel grids already mapped in this process, keyed on the grid files and
+#   stored together with the signature of the grid files they were built from
+_loaded = {}
+
+
+#===================================================================================
+# Cache creation and validation
+#===================================================================================
+
+def get_gridfiles(grid=None, **kwargs):
+   """
+   Resolve a grid specification to a list of integrated grid files.
+
+   :parameter grid: path to an integrated grid (FITS file or grid store), list
+                    of paths (one per metallicity) or a grid name known to
+                    ivs.sed.model
+   :return: list of absolute file names
+   """
+   if grid is None or not (isinstance(grid, (list, tuple)) or os.path.exists(grid)):
+      from ivs.sed import model
+      if grid is not None:
+         kwargs['grid'] = grid
+      grid = model.get_file(integrated=True, **kwargs)
+
+   if not isinstance(grid, (list, tuple)):
+      grid = [grid]
+
+   return [os.path.abspath(f) for f in grid]
+
+def get_cachedir(gridfiles):
+   """
+   Default location of the cache: a directory next to the (alphabetically)
+   first grid file.
+
+   The name contains a hash of all grid files, so different combinations of
+   grid files sharing the same first file each get their own cache.
+   """
+   paths = sorted(os.path.abspath(f).rstrip(os.sep) for f in gridfiles)
+   key = '\n'.join(paths)
+   base = os.path.splitext(paths[0])[0]
+   return '%s.%s.pixcache' % (base, hashlib.sha1(key.encode()).hexdigest()[:8])
+
+def _signature(gridfiles):
+   """
+   Fingerprint of the source files, used to invalidate the cache.
+   """
+   signature = []
+   for f in gridfiles:
+      #-- meta.json of a grid store is rewritten whenever a column changes
+      st = os.stat(os.path.join(f, 'meta.json') if gridstore.is_store(f) else f)
+      #-- nanosecond modification time, so a rewrite within the same second is noticed
+      mtime = getattr(st, 'st_mtime_ns', None)
+      if mtime is None:
+         mtime = repr(st.st_mtime)
+      signature.append([f, st.st_size, mtime])
+   return signature
+
+def _read_meta(cachedir):
+   """
+   Content of meta.json of a cache, None if it does not exist (yet).
+   """
+   try:
+      with open(os.path.join(cachedir, 'meta.json')) as fh:
+         return json.load(fh)
+   except (IOError, OSError, ValueError):
+      return None
+
+def is_valid(gridfiles, cachedir=None):
+   """
+   Check if a cache exists for these grid files and is still up to date.
+   """
+   if cachedir is None:
+      cachedir = get_cachedir(gridfiles)
+
+   meta = _read_meta(cachedir)
+   if meta is None:
+      return False
+
+   return meta.get('version') == CACHE_VERSION and \
+          meta.get('sources') == _signature(gridfiles)
+
+def read_gridfile(gridfile):
+   """
+   Read one integrated grid, in FITS format or a grid store.
+
+   The columns of a grid store are memory-mapped and returned as is, without
+   converting them to float64.
+
+   :return: (parameters, columns, data) where parameters is a dict of the axis
+            columns, columns the list of flux columns (labs first) and data a
+            dict of the flux columns by name.
+   """
+   if gridstore.is_store(gridfile):
+      table, meta = gridstore.open_store(gridfile)
+      names, header = meta['columns'], meta.get('header', {})
+      field = lambda name: table[name]
+   else:
+      hdu = pyfits.open(gridfile)
+      table, header = hdu[1].data, hdu[1].header
+      names = [n for n in table.columns.names]
+      field = table.field
+
+   lnames = [n.lower() for n in names]
+   nrows = len(field(names[0]))
+
+   parameters = {}
+   for ax in AXES:
+      if ax in lnames:
+         parameters[ax] = np.array(field(names[lnames.index(ax)]), float)
+      elif ax == 'z':
+         #-- metallicity of a single-z file is stored in the header
+         parameters[ax] = np.ones(nrows) * header.get('Z', 0.0)
+      else:
+         parameters[ax] = np.zeros(nrows)
+
+   columns = ['labs'] + [n for n, l in zip(names, lnames) if not l in PARAMETERS]
+   data = dict([(c, field(names[lnames.index(c.lower())])) for c in columns])
+
+   if not gridstore.is_store(gridfile):
+      hdu.close()
+
+   return parameters, columns, data
+
+def read_gridfiles(gridfiles):
+   """
+   Read integrated grid files (one per metallicity) that contain the same columns.
+
+   :return: (parameters, columns, column) where parameters is a dict of the axis
+            values of all models, columns the list of flux columns (labs first)
+            and column a function returning the values of one column over all
+            files. Only one column at a time is read into memory.
+   """
+   grids = [read_gridfile(gridfile) for gridfile in gridfiles]
+   for gridfile, (pars, cols, dat) in zip(gridfiles, grids):
+      if cols != grids[0][1]:
+         raise ValueError('Grid files do not contain the same photbands: %s' % gridfile)
+
+   parameters = dict([(ax, np.hstack([g[0][ax] for g in grids])) for ax in AXES])
+
+   def column(name):
+      if len(grids) == 1:
+         return grids[0][2][name]
+      return np.hstack([g[2][name] for g in grids])
+
+   return parameters, grids[0][1], column
+
+def _grid_index(parameters):
+   """
+   Axis values of the pixel grid, and the pixel of every model in it.
+   """
+   axis_values = [np.unique(parameters[ax]) for ax in AXES]
+   index = tuple([np.searchsorted(v, parameters[ax]) for v, ax in zip(axis_values, AXES)])
+   return axis_values, index
+
+def build_cache(gridfiles, cachedir=None, dtype='f8'):
+   """
+   Load the integrated grid files, build the pixel grid and store it.
+
+   Fluxes and absolute luminosities are stored as log10 values, as
+   interpolation is done in log space. Extinction coefficients of a continuous
+   E(B-V) grid (see integrate_grid.calc_extinction_grid) are stored as is.
+   The pixel grid is filled one column at a time, so apart from the pixel grid
+   itself only one column is held in memory.
+
+   Grids do not need to be square in teff-logg: missing grid points are filled
+   with nan, and interpolation near them will return nan.
+
+   :parameter list gridfiles: integrated grid files, one per metallicity
+   :parameter str cachedir: where to store the cache (default next to the grid)
+   :parameter str dtype: float type to store the cube in ('f4' halves the size)
+   :return: the cache directory
+   """
+   if cachedir is None:
+      cachedir = get_cachedir(gridfiles)
+
+   parameters, columns, column = read_gridfiles(gridfiles)
+   axis_values, index = _grid_index(parameters)
+
+   pixelgrid = np.empty([len(v) for v in axis_values] + [len(columns)], dtype)
+   pixelgrid[:] = np.nan
+   for k, name in enumerate(columns):
+      values = np.asarray(column(name), float)
+      #-- extinction coefficients of a continuous E(B-V) grid are not logged
+      if not EXT in name:
+         with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.log10(values)
+      pixelgrid[index + (k,)] = values
+
+   write_cache(cachedir, axis_values, pixelgrid, columns, sources=_signature(gridfiles))
+
+   return cachedir
+
+def write_cache(cachedir, axis_values, pixelgrid, columns, sources=None, **meta):
+   """
+   Write a pixel grid to a cache directory.
+
+   The cache is written to a private temporary directory next to cachedir and
+   renamed into place when complete, so concurrent readers never see a half
+   written cache. When several processes build the same cache at once, the
+   first one to finish wins and the others discard their copy. An out of date
+   cache is moved aside before the new one is moved in; processes that already
+   mapped it keep their open files.
+   """
+   parent, name = os.path.split(os.path.abspath(cachedir).rstrip(os.sep))
+   try:
+      os.makedirs(parent)
+   except OSError:
+      if not os.path.isdir(parent):
+         raise
+
+   tmpdir = tempfile.mkdtemp(prefix=name + '.', suffix='.tmp', dir=parent)
+   try:
+      np.save(os.path.join(tmpdir, 'pixelgrid.npy'), np.ascontiguousarray(pixelgrid))
+      np.savez(os.path.join(tmpdir, 'axes.npz'), **dict(zip(AXES, axis_values)))
+      meta.update(dict(version=CACHE_VERSION, axes=AXES, columns=columns,
+                       shape=list(pixelgrid.shape), sources=sources or []))
+      #-- meta.json is written last: its presence marks a complete cache
+      with open(os.path.join(tmpdir, 'meta.json'), 'w') as fh:
+         json.dump(meta, fh, indent=1)
+
+      try:
+         os.rename(tmpdir, cachedir)
+         return
+      except OSError:
+         #-- the cache directory exists: fx. another process just finished
+         if _read_meta(cachedir) == json.loads(json.dumps(meta)):
+            return
+
+      #-- out of date cache: move it aside and try once more
+      olddir = tempfile.mkdtemp(prefix=name + '.', suffix='.old', dir=parent)
+      try:
+         os.rename(cachedir, os.path.join(olddir, name))
+      except OSError:
+         pass
+      try:
+         os.rename(tmpdir, cachedir)
+      except OSError:
+         #-- another process moved its new cache in first
+         pass
+      shutil.rmtree(olddir, ignore_errors=True)
+   finally:
+      shutil.rmtree(tmpdir, ignore_errors=True)
+
+def load_cache(cachedir):
+   """
+   Memory-map a pixel grid cache.
+
+   :return: (axis_values, pixelgrid, columns)
+   """
+   with open(os.path.join(cachedir, 'meta.json')) as fh:
+      meta = json.load(fh)
+
+   axes = np.load(os.path.join(cachedir, 'axes.npz'))
+   axis_values = [axes[ax] for ax in meta['axes']]
+   pixelgrid = np.load(os.path.join(cachedir, 'pixelgrid.npy'), mmap_mode='r')
+
+   return axis_values, pixelgrid, meta['columns']
+
+def get_pixelgrid(grid=None, cachedir=None, **kwargs):
+   """
+   Return the memory-mapped pixel grid for a grid, building the cache if it
+   does not exist or is out of date.
+
+   :parameter grid: grid name, integrated grid file or list of files
+   :parameter str cachedir: location of the cache (default next to the grid)
+   :return: (axis_values, pixelgrid, columns)
+   """
+   gridfiles = get_gridfiles(grid, **kwargs)
+   if cachedir is None:
+      cachedir = get_cachedir(gridfiles)
+
+   #-- a pixel grid mapped earlier is reused as long as the grid files did not change
+   key, signature = tuple(gridfiles), _signature(gridfiles)
+   if key in _loaded and _loaded[key][0] == signature:
+      return _loaded[key][1]
+
+   if not is_valid(gridfiles, cachedir):
+      with span('pixgrid.build_cache', cachedir=cachedir):
+         build_cache(gridfiles, cachedir=cachedir)
+
+   with span('pixgrid.load_cache', cachedir=cachedir):
+      _loaded[key] = signature, load_cache(cachedir)
+   return _loaded[key][1]
+
+
+#===================================================================================
+# Interpolation
+#===================================================================================
+
+@instrumented('pixgrid.interpolate')
+def interpolate(p, axis_values, pixelgrid, cols=None):
+   """
+   Multilinear interpolation in a regular pixel grid.
+
+   Points outside the grid or in a cell with a missing grid point return nan.
+   Axes with only one value (fx. a single metallicity) are not interpolated,
+   the requested value on such an axis is ignored.
+
+   :parameter array p: (n_axes x N) array of points
+   :parameter list axis_values: sorted values of each axis
+   :parameter array pixelgrid: grid of shape (len(ax1), ..., len(axn), n_columns)
+   :parameter array cols: indices of the columns to return (default all)
+   :return: (N x n_cols) array
+   """
+   p = np.atleast_2d(np.asarray(p, float))
+   n = p.shape[1]
+   if cols is None:
+      cols = np.arange(pixelgrid.shape[-1])
+   cols = np.asarray(cols)[None, :]
+
+   lower, weight, offsets = [], [], []
+   for values, x in zip(axis_values, p):
+      if len(values) == 1:
+         lower.append(np.zeros(n, int))
+         weight.append(np.zeros(n))
+         offsets.append([0])
+         continue
+
+      i = np.clip(np.searchsorted(values, x, side='right') - 1, 0, len(values) - 2)
+      w = (x - values[i]) / (values[i + 1] - values[i])
+      w[(x < values[0]) | (x > values[-1]) | np.isnan(x)] = np.nan
+
+      lower.append(i)
+      weight.append(w)
+      offsets.append([0, 1])
+
+   result = np.zeros((n, cols.shape[1]))
+   for corner in itertools.product(*offsets):
+      wt = np.ones(n)
+      index = []
+      for i, w, c in zip(lower, weight, corner):
+         wt = wt * (w if c else 1 - w)
+         index.append((i + c)[:, None])
+
+      values = pixelgrid[tuple(index) + (cols,)]
+
+      #-- corners with zero weight may lie on a missing grid point
+      result += np.where(wt[:, None] == 0, 0., wt[:, None] * values)
+
+   return result
+
+def _get_photbands(columns):
+   """
+   All photbands available in a grid.
+   """
+   return [c for c in columns[1:] if not EXT in c]
+
+def _get_columns(columns, photbands):
+   """
+   Indices of the requested photbands (and labs as last column) in the grid.
+   """
+   if photbands is None:
+      photbands = _get_photbands(columns)
+
+   missing = [pb for pb in photbands if not pb in columns]
+   if missing:
+      raise ValueError('Photbands not available in integrated grid: %s' % ', '.join(missing))
+
+   return np.array([columns.index(pb) for pb in photbands] + [columns.index('labs')])
+
+def _get_ext_columns(columns, photbands):
+   """
+   Indices of the extinction coefficients of the requested photbands as an
+   (order x n_photbands) array, or None if the grid has an E(B-V) axis.
+   """
+   if photbands is None:
+      photbands = _get_photbands(columns)
+
+   order = len([c for c in columns if c.startswith(photbands[0] + EXT)])
+   if order == 0:
+      return None
+
+   return np.array([[columns.index('%s%s%i' % (pb, EXT, k + 1)) for pb in photbands]
+                    for k in range(order)])
+
+def get_itable_pix(teff=None, logg=None, ebv=None, z=None, rad=None, photbands=None,
+                   grid=None, cachedir=None, **kwargs):
+   """
+   Drop-in replacement for model.get_itable_pix using the memory-mapped cache.
+
+   :parameter array teff: effective temperatures
+   :parameter array logg: surface gravities
+   :parameter array ebv: reddening (default 0)
+   :parameter array z: metallicity (default 0)
+   :parameter array rad: radius, fluxes are scaled with rad**2 (default 1)
+   :parameter list photbands: photbands to return, default all in the grid
+   :parameter grid: grid name, integrated grid file or list of files
+   :return: (iflux, Labs), iflux has shape (n_photbands x N)
+   """
+   axis_values, pixelgrid, columns = get_pixelgrid(grid=grid, cachedir=cachedir, **kwargs)
+
+   return _itable_pix(axis_values, pixelgrid, columns, photbands,
+                      teff=teff, logg=logg, ebv=ebv, z=z, rad=rad)
+
+def _itable_pix(axis_values, pixelgrid, columns, photbands, teff=None, logg=None,
+                ebv=None, z=None, rad=None):
+   """
+   Interpolate integrated fluxes and Labs of one component in a pixel grid.
+
+   In a continuous E(B-V) grid the ebv axis has only the value 0, and the
+   reddening is applied with the interpolated extinction coefficients:
+   flux * 10**(-0.4 * (c_1 ebv + c_2 ebv^2 + ...))
+   """
+   cols = _get_columns(columns, photbands)
+   ext = _get_ext_columns(columns, photbands)
+
+   teff = np.atleast_1d(np.asarray(teff, float))
+   n = len(teff)
+   count('pixgrid.models', n)
+   p = [teff] + [np.ones(n) * (0. if x is None else np.asarray(x, float))
+                 for x in (logg, ebv, z)]
+
+   if ext is None:
+      values = 10**interpolate(np.array(p), axis_values, pixelgrid, cols=cols)
+   else:
+      values = interpolate(np.array(p), axis_values, pixelgrid,
+                           cols=np.hstack([cols, ext.ravel()]))
+      coef = values[:, len(cols):].reshape(n, ext.shape[0], ext.shape[1])
+      values = 10**values[:, :len(cols)]
+
+      ebv = p[2][:, None]
+      A = np.sum([coef[:, k] * ebv**(k + 1) for k in range(ext.shape[0])], axis=0)
+      values[:, :-1] *= 10**(-0.4 * A)
+
+   scale = 1. if rad is None else np.asarray(rad, float)**2
+   flux = values[:, :-1].T * scale
+   Labs = values[:, -1] * scale
+
+   return flux, Labs
+
+def get_itable_pix_multiple(photbands=None, grids=None, distance=None, **kwargs):
+   """
+   Vectorized integrated photometry of binary (or higher order) models.
+
+   Every grid is interpolated once for all N parameter sets, after which the
+   components are scaled with their radius and the distance, and summed.
+   Stellar parameters are given per component with the component number as
+   suffix (teff1, logg1, rad1, ebv1, z1, teff2, ...). Parameters without a
+   suffix (fx. ebv) are used for all components.
+
+   >>> flux, Labs, cflux, cLabs = get_itable_pix_multiple(
+   ...         teff1=teffs1, logg1=loggs1, rad1=rads1,
+   ...         teff2=teffs2, logg2=loggs2, rad2=rads2, ebv=ebvs,
+   ...         photbands=photbands, grids=['tmap', 'kurucz2'])
+
+   :parameter list photbands: photbands to return, default all in the first grid
+   :parameter list grids: grid specification of each component: a grid name,
+                          integrated grid file, list of files or a dict of
+                          defaults. Default is model.defaults_multiple
+   :parameter array distance: distance in the same units as the radii, fluxes
+                              are scaled with 1/distance**2 (default 1)
+   :return: (iflux, Labs, component_iflux, component_Labs) with shapes
+            (n_photbands x N), (N), (n_comp x n_photbands x N) and (n_comp x N)
+   """
+   if grids is None:
+      from ivs.sed import model
+      grids = model.defaults_multiple
+
+   if photbands is None:
+      photbands = _get_photbands(_get_grid(grids[0])[2])
+
+   #-- all parameters are broadcast to the same number of models
+   n = max([np.size(v) for v in kwargs.values()] + [1])
+
+   cflux, cLabs = [], []
+   for i, grid in enumerate(grids):
+      pars = {}
+      for name in ['teff', 'logg', 'ebv', 'z', 'rad']:
+         value = kwargs.get('%s%i' % (name, i + 1), kwargs.get(name, None))
+         pars[name] = None if value is None else np.ones(n) * value
+
+      axis_values, pixelgrid, columns = _get_grid(grid)
+      flux, Labs = _itable_pix(axis_values, pixelgrid, columns, photbands, **pars)
+
+      cflux.append(flux)
+      cLabs.append(Labs)
+
+   cflux, cLabs = np.array(cflux), np.array(cLabs)
+
+   if distance is not None:
+      cflux = cflux / np.asarray(distance, float)**2
+
+   return cflux.sum(axis=0), cLabs.sum(axis=0), cflux, cLabs
+
+def _get_grid(grid):
+   """
+   Pixel grid for a grid specification, which can also be a dict of defaults.
+   """
+   if isinstance(grid, dict):
+      return get_pixelgrid(**grid)
+   return get_pixelgrid(grid=grid)
+
+
+if __name__ == "__main__":
+   import argparse
+
+   parser = argparse.ArgumentParser(description="""
+   Build (or rebuild) the memory-mapped pixel grid cache of an integrated grid.
+   """)
+   parser.add_argument("gridfiles", type=str, nargs='+',
+                     help="The integrated grid file(s), one per metallicity")
+   parser.add_argument("-cachedir", type=str, dest='cachedir', default=None,
+                     help="Cache location (default next to the grid)")
+   parser.add_argument("-dtype", type=str, dest='dtype', default='f8',
+                     help="Float type of the stored cube (default f8)")
+   args = parser.parse_args()
+
+   gridfiles = [os.path.abspath(f) for f in args.gridfiles]
+   cachedir = build_cache(gridfiles, cachedir=args.cachedir, dtype=args.dtype)
+   print('Pixel grid cache written to %s' % cachedir)
@@ -0,0 +1,123 @@
+"""
+Extract a small, focused subgrid from an integrated grid.
+
+Interpolation time and memory use grow with the size of the grid. For the
+interactive fit of a single system it pays to cut out only the part of the grid
+around the expected parameters, and only the photbands that are observed. The
+subgrid is written as a grid store (see gridstore.py) together with its
+prebuilt pixel grid cache (see pixgrid.py), so the first fit starts instantly.
+The path of the subgrid can be given to the fit tools instead of a grid name.
+
+>>> sub = make_subgrid('kurucz2', 'BD+34.1543_ms.igrid', teffrange=(5800, 7000),
+...                    loggrange=(3.5, 4.5), ebvrange=(0, 0.1), photbands=photbands)
+>>> iflux, Labs = pixgrid.get_itable_pix(teff=teffs, logg=loggs, grid=sub)
+"""
+
+import os
+
+import numpy as np
+
+import gridstore
+import pixgrid
+
+
+def _enclose(values, valrange):
+   """
+   Mask selecting the grid values within valrange, extended to the nearest grid
+   values outside the range so that interpolation over the full range is
+   possible.
+   """
+   if valrange is None:
+      return np.ones(len(values), bool)
+
+   grid = np.unique(values)
+   lower = grid[grid <= valrange[0]]
+   upper = grid[grid >= valrange[1]]
+   vmin = lower[-1] if len(lower) else grid[0]
+   vmax = upper[0] if len(upper) else grid[-1]
+
+   return (values >= vmin) & (values <= vmax)
+
+def make_subgrid(grid, path, photbands=None, teffrange=None, loggrange=None, ebvrange=None,
+                 zrange=None, dtype=None, **kwargs):
+   """
+   Cut a subgrid out of an integrated grid and prepare it for fast loading.
+
+   The parameter ranges are extended to the enclosing grid points. Ranges that
+   are not given are not cut. For a continuous E(B-V) grid the ebvrange is
+   ignored, as it has no E(B-V) axis.
+
+   :parameter grid: grid name, integrated grid file (FITS or grid store), or a
+                    list of files (one per metallicity)
+   :parameter str path: the grid store to write
+   :parameter list photbands: photbands to keep (default all)
+   :parameter tuple teffrange: (min, max) effective temperature
+   :parameter tuple loggrange: (min, max) surface gravity
+   :parameter tuple ebvrange: (min, max) E(B-V)
+   :parameter tuple zrange: (min, max) metallicity
+   :parameter str dtype: float type of the stored columns (default float64)
+   :return: the path of the subgrid
+   """
+   gridfiles = pixgrid.get_gridfiles(grid, **kwargs)
+
+   parameters, columns, column = pixgrid.read_gridfiles(gridfiles)
+
+   #-- the photbands to keep, with their extinction coefficients if present
+   if photbands is None:
+      photbands = pixgrid._get_photbands(columns)
+   missing = [pb for pb in photbands if not pb in columns]
+   if missing:
+      raise ValueError('Photbands not available in integrated grid: %s' % ', '.join(missing))
+   names = ['labs'] + [c for c in columns[1:] if c.split(pixgrid.EXT)[0] in photbands]
+   continuous = any([pixgrid.EXT in c for c in names])
+
+   keep = _enclose(parameters['teff'], teffrange) & _enclose(parameters['logg'], loggrange) & \
+          _enclose(parameters['z'], zrange)
+   if not continuous:
+      keep &= _enclose(parameters['ebv'], ebvrange)
+
+   if not np.any(keep):
+      raise ValueError('No models of the grid are within the given ranges')
+
+   subset = dict([(ax, parameters[ax][keep]) for ax in pixgrid.AXES])
+   for name in names:
+      subset[name] = np.asarray(column(name))[keep].astype(float)
+
+   if dtype is not None:
+      subset = dict([(k, v.astype(dtype)) for k, v in subset.items()])
+
+   gridstore.create(path, subset, names=pixgrid.AXES + names,
+                    source=[os.path.basename(f) for f in gridfiles],
+                    teffrange=teffrange, loggrange=loggrange, ebvrange=ebvrange, zrange=zrange)
+
+   #-- prebuild the lookup index next to the subgrid
+   pixgrid.build_cache([os.path.abspath(path)])
+
+   return path
+
+
+if __name__ == "__main__":
+   import argparse
+
+   parser = argparse.ArgumentParser(description="""
+   Cut a small subgrid out of an integrated grid for fast interactive fitting.
+   """)
+   parser.add_argument("grid", type=str,
+                     help="Grid name or path of the integrated grid")
+   parser.add_argument("path", type=str,
+                     help="The subgrid to write")
+   parser.add_argument("-teff", type=float, nargs=2, dest='teffrange', default=None,
+                     help="Effective temperature range (min max)")
+   parser.add_argument("-logg", type=float, nargs=2, dest='loggrange', default=None,
+                     help="Surface gravity range (min max)")
+   parser.add_argument("-ebv", type=float, nargs=2, dest='ebvrange', default=None,
+                     help="E(B-V) range (min max)")
+   parser.add_argument("-z", type=float, nargs=2, dest='zrange', default=None,
+                     help="Metallicity range (min max)")
+   parser.add_argument("-photbands", type=str, nargs='+', dest='photbands', default=None,
+                     help="Photbands to include (default all)")
+   args = parser.parse_args()
+
+   path = make_subgrid(args.grid, args.path, photbands=args.photbands, teffrange=args.teffrange,
+                       loggrange=args.loggrange, ebvrange=args.ebvrange, zrange=args.zrange)
+   print('Subgrid written to %s' % path)
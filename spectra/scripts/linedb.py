@@ -0,0 +1,277 @@
+"""
+Compiled binary line database for fast line list queries.
+
+linelists.get_lines reads and filters the raw line list of the requested
+spectral type on every call. This module compiles all line lists once into a
+binary database: one wavelength sorted list of all transitions, and a depth
+table of shape (n_teff, n_logg, n_lines) on the teff-logg grid of the line
+lists. Both are memory-mapped, so a query only touches the part of the table
+in the requested wavelength range.
+
+Compile the database once (this takes a while):
+
+>>> compile_database('linelists.linedb')
+
+and query it with the same arguments as linelists.get_lines:
+
+>>> lines = get_lines(20000, 4.0, atoms=['Si'], wrange=(4500, 4600), db='linelists.linedb')
+
+Both components of a composite binary can be queried at once:
+
+>>> lines = get_lines_multiple([(28000, 5.5), (6000, 4.0)], wrange=(4460, 4480),
+...                            db='linelists.linedb')
+"""
+
+import os
+import json
+
+import numpy as np
+
+DB_VERSION = 1
+
+#-- teff-logg grid of the line lists, see linelists.rst
+TEFFS = np.hstack([np.arange(5000, 10000, 200), np.arange(10000, 13500, 500),
+                   np.arange(14000, 20000, 1000), np.arange(20000, 30000, 2000),
+                   np.arange(30000, 50001, 5000)]).astype(float)
+LOGGS = np.arange(1.0, 5.01, 0.5)
+
+#-- databases already mapped in this process
+_loaded = {}
+
+
+#===================================================================================
+# Compilation
+#===================================================================================
+
+def _roman(n):
+   numerals = [(10, 'X'), (9, 'IX'), (5, 'V'), (4, 'IV'), (1, 'I')]
+   result = ''
+   for value, numeral in numerals:
+      while n >= value:
+         result += numeral
+         n -= value
+   return result
+
+def _ioncode(ion):
+   """
+   Integer version of the numerical ion code: 14.02 -> 1402
+   """
+   return np.round(np.asarray(ion, float) * 100).astype(int)
+
+def compile_database(path, teffs=None, loggs=None):
+   """
+   Compile all line lists into a binary database.
+
+   The line lists are read with linelists.get_lines for every grid point. For
+   teff-logg combinations without a line list, get_lines returns the closest
+   grid point, and so does the database.
+
+   :parameter str path: directory to write the database to
+   :parameter array teffs: effective temperature grid (default TEFFS)
+   :parameter array loggs: surface gravity grid (default LOGGS)
+   :return: the path of the database
+   """
+   from ivs.spectra import linelists
+
+   teffs = TEFFS if teffs is None else np.asarray(teffs, float)
+   loggs = LOGGS if loggs is None else np.asarray(loggs, float)
+
+   #-- read all line lists
+   nodes, keys = [], []
+   for teff in teffs:
+      for logg in loggs:
+         data = linelists.get_lines(teff, logg)
+         nodes.append(data)
+         keys.append(np.rec.fromarrays([np.asarray(data['wavelength'], float),
+                                        _ioncode(data['ion'])], names=['wavelength', 'ion']))
+
+   #-- one wavelength sorted list of all transitions
+   lines, inverse = np.unique(np.hstack(keys), return_inverse=True)
+   inverse = inverse.ravel()
+
+   depth = np.zeros((len(teffs), len(loggs), len(lines)), np.float32)
+   start = 0
+   for i, data in enumerate(nodes):
+      it, ig = divmod(i, len(loggs))
+      depth[it, ig, inverse[start:start + len(data)]] = data['depth']
+      start += len(data)
+
+   #-- ion names and atom symbols for filtering and return_name
+   names = dict([(int(c), linelists.ioncode2name(c / 100.)) for c in np.unique(lines['ion'])])
+
+   if not os.path.isdir(path):
+      os.makedirs(path)
+   np.save(os.path.join(path, 'wavelength.npy'), lines['wavelength'].astype(float))
+   np.save(os.path.join(path, 'ion.npy'), lines['ion'].astype(np.int32))
+   np.save(os.path.join(path, 'depth.npy'), depth)
+
+   meta = dict(version=DB_VERSION, teffs=list(teffs), loggs=list(loggs),
+               ion_names=dict([(str(k), v) for k, v in names.items()]))
+   with open(os.path.join(path, 'meta.json'), 'w') as fh:
+      json.dump(meta, fh, indent=1)
+
+   return path
+
+def load_database(path):
+   """
+   Memory-map a compiled line database.
+
+   :return: dict with wavelength, ion, depth, teffs, loggs and ion_names
+   """
+   if path is None:
+      raise ValueError('No line database given, compile one with compile_database')
+   if path in _loaded:
+      return _loaded[path]
+
+   with open(os.path.join(path, 'meta.json')) as fh:
+      meta = json.load(fh)
+
+   db = dict(wavelength=np.load(os.path.join(path, 'wavelength.npy'), mmap_mode='r'),
+             ion=np.load(os.path.join(path, 'ion.npy'), mmap_mode='r'),
+             depth=np.load(os.path.join(path, 'depth.npy'), mmap_mode='r'),
+             teffs=np.array(meta['teffs']), loggs=np.array(meta['loggs']),
+             ion_names=dict([(int(k), v) for k, v in meta['ion_names'].items()]))
+
+   _loaded[path] = db
+   return db
+
+
+#===================================================================================
+# Queries
+#===================================================================================
+
+def _ion_selection(db, ioncodes, atoms=None, ions=None):
+   """
+   Mask of the lines that belong to the requested atoms and ions. Atoms and
+   ions can be given as name ('Si', 'SiIII') or number (14, 14.02).
+   """
+   mask = np.ones(len(ioncodes), bool)
+
+   if atoms is not None:
+      numbers = []
+      for atom in atoms:
+         if isinstance(atom, str):
+            #-- symbol of the atom is the ion name without the ionisation stage
+            numbers += [c // 100 for c, name in db['ion_names'].items()
+                        if name[:len(name) - len(_roman(c % 100 + 1))] == atom]
+         else:
+            numbers.append(int(atom))
+      mask &= np.isin(ioncodes // 100, numbers)
+
+   if ions is not None:
+      codes = []
+      for ion in ions:
+         if isinstance(ion, str):
+            codes += [c for c, name in db['ion_names'].items() if name == ion]
+         else:
+            codes.append(int(_ioncode(ion)))
+      mask &= np.isin(ioncodes, codes)
+
+   return mask
+
+def _depths(db, teff, logg, i0, i1, interpolate):
+   """
+   Depth of the lines i0 to i1 for one spectral type.
+   """
+   teffs, loggs = db['teffs'], db['loggs']
+
+   if not interpolate:
+      it = np.argmin(np.abs(teffs - teff))
+      ig = np.argmin(np.abs(loggs - logg))
+      return np.array(db['depth'][it, ig, i0:i1], float)
+
+   #-- bilinear interpolation in the depth tables, clipped to the grid
+   def _weights(values, x):
+      x = np.clip(x, values[0], values[-1])
+      i = np.clip(np.searchsorted(values, x, side='right') - 1, 0, len(values) - 2)
+      return i, (x - values[i]) / (values[i + 1] - values[i])
+
+   it, wt = _weights(teffs, teff)
+   ig, wg = _weights(loggs, logg)
+   d = db['depth']
+   return (1 - wt) * (1 - wg) * d[it, ig, i0:i1] + wt * (1 - wg) * d[it + 1, ig, i0:i1] + \
+          (1 - wt) * wg * d[it, ig + 1, i0:i1] + wt * wg * d[it + 1, ig + 1, i0:i1]
+
+def _remove_blends(wavelength, blend):
+   """
+   Mask of the lines that have no neighbour closer than blend.
+   """
+   if blend <= 0 or len(wavelength) < 2:
+      return np.ones(len(wavelength), bool)
+
+   dw = np.diff(wavelength)
+   close = dw < blend
+   return ~(np.hstack([close, False]) | np.hstack([False, close]))
+
+def get_lines(teff, logg, atoms=None, ions=None, wrange=(-np.inf, np.inf), blend=0.0,
+              return_name=False, db=None, interpolate=False):
+   """
+   Retrieve line transitions and depths for a specific stellar type from a
+   compiled database. Same interface as linelists.get_lines.
+
+   By default the closest grid point is used, as in linelists.get_lines. With
+   interpolate=True the line depths are linearly interpolated in teff and logg.
+
+   :parameter float teff: effective temperature
+   :parameter float logg: surface gravity
+   :parameter list atoms: atoms to include (name or number), default all
+   :parameter list ions: ions to include (name or ion code), default all
+   :parameter tuple wrange: (min, max) wavelength range
+   :parameter float blend: lines closer than this to their neighbour are removed
+   :parameter bool return_name: return ion names instead of numerical ion codes
+   :parameter str db: path of the compiled database (required)
+   :parameter bool interpolate: interpolate the depths between grid points
+   :return: record array with wavelength, ion and depth
+   """
+   db = load_database(db)
+
+   i0, i1 = np.searchsorted(db['wavelength'], [wrange[0], wrange[1]])
+   wavelength = np.array(db['wavelength'][i0:i1])
+   ioncodes = np.array(db['ion'][i0:i1])
+   depth = _depths(db, teff, logg, i0, i1, interpolate)
+
+   keep = (depth > 0) & _ion_selection(db, ioncodes, atoms=atoms, ions=ions)
+   wavelength, ioncodes, depth = wavelength[keep], ioncodes[keep], depth[keep]
+
+   keep = _remove_blends(wavelength, blend)
+   wavelength, ioncodes, depth = wavelength[keep], ioncodes[keep], depth[keep]
+
+   if return_name:
+      ion = np.array([db['ion_names'][c] for c in ioncodes], dtype='a7')
+   else:
+      ion = ioncodes / 100.
+
+   return np.rec.fromarrays([wavelength, ion, depth], names=['wavelength', 'ion', 'depth'])
+
+def get_lines_multiple(components, **kwargs):
+   """
+   Query the lines of several spectral types at once, fx. both components of a
+   composite binary.
+
+   :parameter list components: list of (teff, logg) tuples
+   :parameter kwargs: other arguments of get_lines
+   :return: record array with wavelength, ion, depth and component (starting
+            at 1), sorted on wavelength
+   """
+   lines = []
+   for i, (teff, logg) in enumerate(components):
+      data = get_lines(teff, logg, **kwargs)
+      comp = np.ones(len(data), int) * (i + 1)
+      lines.append(np.rec.fromarrays([data['wavelength'], data['ion'], data['depth'], comp],
+                                     names=['wavelength', 'ion', 'depth', 'component']))
+
+   lines = np.hstack(lines).view(np.recarray)
+   return lines[np.argsort(lines['wavelength'], kind='mergesort')]
+
+
+if __name__ == "__main__":
+   import argparse
+
+   parser = argparse.ArgumentParser(description="""
+   Compile the line lists of the IVS repository into a binary line database.
+   """)
+   parser.add_argument("path", type=str,
+                     help="The directory to write the database to")
+   args = parser.parse_args()
+
+   print('Line database written to %s' % compile_database(args.path))
@@ -1,3 +1,5 @@
+from __future__ import print_function
+
 import os
 
 import numpy as np
@@ -7,6 +9,8 @@ from ivs.io import ascii, fits, hdf5
 from ivs.spectra import linelists
 from ivs.spectra import tools as stools
 
+import linedb as ldb
+
 class SFI(object):
    """
    Interactive matplotlib plot to fit a gaussian profile to a spectral line.
@@ -47,7 +51,8 @@ class SFI(object):
    To exit and return rv and error to the main script press enter.
    """
 
-   def __init__(self, wave, flux, teff=5500, logg=4.5, binsize=1, vrad=0, fig=None, title=''):
+   def __init__(self, wave, flux, teff=5500, logg=4.5, binsize=1, vrad=0, fig=None, title='',
+                linedb=None):
       """
       Create the LineFitter object
       
@@ -57,6 +62,7 @@ class SFI(object):
       :parameter int binsize: Automatically rebin provided spectra to this binsize
       :parameter object fig: mpl figure to use, optional
       :parameter str title: Title of the plot, optional
+      :parameter str linedb: path to a compiled line database (see linedb.py), optional
       :return: instantiated :class:`LineFitter` object
       """
       
@@ -76,6 +82,7 @@ class SFI(object):
       
       self.teff = teff
       self.logg = logg
+      self.linedb = linedb
       
       self.lines = np.empty((0,), dtype=[('wavelength', 'f8'), ('depth', 'f8'), ('ion', 'a7')])
       
@@ -109,7 +116,7 @@ class SFI(object):
       pl.ylabel('Flux')
       pl.show()
       
-      print 'Returning', self.rv, self.err
+      print('Returning', self.rv, self.err)
       return self.rv, self.err
    
    def update_figure(self):
@@ -147,8 +154,12 @@ class SFI(object):
       Get the spectral line information and add to figure
       """
       
-      lines = linelists.get_lines(teff=self.teff, logg=self.logg, wrange=(wave-1, wave+1), 
-                                  blend=0.1, return_name=True)
+      if self.linedb is not None:
+         lines = ldb.get_lines(self.teff, self.logg, wrange=(wave-1, wave+1),
+                               blend=0.1, return_name=True, db=self.linedb)
+      else:
+         lines = linelists.get_lines(teff=self.teff, logg=self.logg, wrange=(wave-1, wave+1), 
+                                     blend=0.1, return_name=True)
       
       self.lines = np.hstack([self.lines, lines])
    
@@ -273,9 +284,9 @@ class SFI(object):
             self.wave = stools.doppler_shift(self.wave, self.vrad, vrad_units='km/s')
             self.binsize = binsize
             self.update_figure()
-         except Exception, e:
-            print e
-            print "Could not rebin spectrum"
+         except Exception as e:
+            print(e)
+            print("Could not rebin spectrum")
       
       if event.key == 'v':
          # Change the radial velocity shift
@@ -287,9 +298,9 @@ class SFI(object):
             self.wave = stools.doppler_shift(self.wave, vrad, vrad_units='km/s')
             self.vrad = vrad
             self.update_figure()
-         except Exception, e:
-            print e
-            print "Could not shift spectrum"
+         except Exception as e:
+            print(e)
+            print("Could not shift spectrum")
       
       if event.key == 'enter':
          pl.close()
@@ -315,6 +326,8 @@ if __name__=='__main__':
                      help="Effective temperature of the star (default=6000)")
    parser.add_argument("-logg", type=float, dest='logg', default=0,
                      help="surface gravity of the star (default=4.5)")
+   parser.add_argument("-linedb", type=str, dest='linedb', default=None,
+                     help="compiled line database to use (see linedb.py)")
    args, variables = parser.parse_known_args()
    
    
@@ -332,5 +345,5 @@ if __name__=='__main__':
    fig = pl.figure(1, figsize=(14, 6))
    pl.subplots_adjust(left=0.07, top=0.85, right=0.99, bottom=0.09)
    sf = SFI(wave, flux, fig=fig, vrad=args.vrad, binsize=args.binsize, 
-            teff=args.teff, logg=args.logg)
+            teff=args.teff, logg=args.logg, linedb=args.linedb)
    sf.show()
\ No newline at end of file
@@ -0,0 +1,315 @@
+"""
+Concurrent, cached pixel fetching from the Earth Engine REST API.
+
+A single getPixels request is limited to 16MB and 10000 pixels in either
+dimension, and the notebook downloads the same pixels again on every run. This
+module splits an area of interest into tiles on a global tile grid, requests
+the tiles concurrently through one pooled session, retries failed requests,
+caches the raw responses on disk and mosaics the tiles in memory.
+
+>>> fetcher = TileFetcher(session, cache_dir='tile_cache', max_workers=8)
+>>> bounds = aoi_bounds(wgs_tile_json, 'EPSG:32633')
+>>> pixels = fetcher.fetch(ASSET_ID, ['B2', 'B3', 'B4', 'B8'], bounds,
+...                        scale=10, crs='EPSG:32633')
+>>> pixels.shape
+(4, 256, 256)
+
+The cache key is a hash of the request url and body, so a tile is only
+downloaded again when anything in the request changes. As the tiles lie on a
+global grid, an area that is shifted or enlarged reuses the cached tiles it
+shares with areas fetched before. The base url and the
+session can be replaced, fx. to run against a local stand-in server:
+
+>>> fetcher = TileFetcher(requests.Session(), base_url='http://localhost:8000')
+"""
+
+import io
+import os
+import json
+import math
+import time
+import hashlib
+import tempfile
+import threading
+import concurrent.futures
+
+import numpy as np
+import requests
+
+EE_API = 'https://earthengine.googleapis.com/v1'
+EE_PUBLIC = f'{EE_API}/projects/earthengine-public'
+
+# Earth Engine limit on the number of pixels in either dimension of a request
+MAX_TILE_SIZE = 10000
+
+# Responses that are worth retrying
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def aoi_bounds(geometry, crs):
+    """
+    Bounding box of a GeoJSON geometry (in EPSG:4326) in the given CRS.
+
+    :parameter dict geometry: GeoJSON geometry
+    :parameter str crs: CRS of the image, fx. 'EPSG:32633'
+    :return: (xmin, ymin, xmax, ymax) in the units of the CRS
+    """
+    import pyproj
+    import shapely.geometry, shapely.ops
+
+    transformer = pyproj.Transformer.from_proj(
+        pyproj.Proj('EPSG:4326'), pyproj.Proj(crs), always_xy=True)
+    shape = shapely.ops.transform(transformer.transform, shapely.geometry.shape(geometry))
+    return shape.bounds
+
+
+def make_tiles(bounds, scale, crs, tile_size=512):
+    """
+    Split a bounding box into tiles on a global tile grid. Tiles are always
+    tile_size pixels wide and high and start at a multiple of tile_size pixels
+    from the origin of the CRS, so an area that is shifted or enlarged requests
+    the same tiles (and hits the same cache entries) where it overlaps an area
+    fetched before. The tiles at the edges stick out of the bounding box and are
+    cropped when the mosaic is made.
+
+    :parameter tuple bounds: (xmin, ymin, xmax, ymax) in the units of the CRS
+    :parameter float scale: pixel size in the units of the CRS
+    :parameter str crs: CRS code of the grid
+    :parameter int tile_size: width and height of a tile in pixels
+    :return: (tiles, shape), tiles is a list of (window, grid) with window the
+             (row, col, height, width) of the tile relative to the top left
+             corner of the mosaic (row and col can be negative at the edges) and
+             grid the getPixels grid of the tile. shape is the (height, width)
+             of the mosaic, the pixels covering the bounding box.
+    """
+    if not 0 < tile_size <= MAX_TILE_SIZE:
+        raise ValueError(f'tile_size should be between 1 and {MAX_TILE_SIZE}')
+
+    # bounding box in whole pixels of the global pixel grid, y pixels count down
+    xmin, ymin, xmax, ymax = bounds
+    left, right = _floor(xmin / scale), _ceil(xmax / scale)
+    top, bottom = _floor(-ymax / scale), _ceil(-ymin / scale)
+
+    tiles = []
+    for ty in range(top // tile_size, -(-bottom // tile_size)):
+        for tx in range(left // tile_size, -(-right // tile_size)):
+            x0, y0 = tx * tile_size, ty * tile_size
+            grid = {
+                'dimensions': {'width': tile_size, 'height': tile_size},
+                'affineTransform': {
+                    'scaleX': scale, 'shearX': 0, 'translateX': x0 * scale,
+                    'shearY': 0, 'scaleY': -scale, 'translateY': -y0 * scale,
+                },
+                'crsCode': crs,
+            }
+            tiles.append(((y0 - top, x0 - left, tile_size, tile_size), grid))
+
+    return tiles, (bottom - top, right - left)
+
+
+def _floor(x, eps=1e-6):
+    # bounds that are a whole number of pixels up to rounding errors are not
+    # extended by one pixel
+    return int(math.floor(x + eps))
+
+
+def _ceil(x, eps=1e-6):
+    return int(math.ceil(x - eps))
+
+
+def make_session(session=None, pool_size=8):
+    """
+    Make sure the connection pools of a (new) requests session hold at least
+    pool_size connections, so concurrent requests reuse their connections
+    instead of opening new ones.
+
+    The adapters already mounted on the session (fx. an mTLS adapter of an
+    AuthorizedSession) are kept: their pools are enlarged in place through
+    init_poolmanager, which keeps the options of adapter subclasses. Open
+    connections of an enlarged pool are closed.
+    """
+    if session is None:
+        session = requests.Session()
+    for adapter in session.adapters.values():
+        if isinstance(adapter, requests.adapters.HTTPAdapter) and \
+                getattr(adapter, '_pool_maxsize', 0) < pool_size:
+            adapter.poolmanager.clear()
+            adapter.init_poolmanager(pool_size, pool_size,
+                                     block=getattr(adapter, '_pool_block', False))
+    return session
+
+
+def decode_npy(content):
+    """
+    Decode a NPY getPixels response to a (bands x height x width) array.
+    """
+    data = np.load(io.BytesIO(content), allow_pickle=False)
+    if data.dtype.names:
+        return np.stack([data[name] for name in data.dtype.names])
+    return data.reshape((-1,) + data.shape[-2:])
+
+
+class TileCache:
+    """
+    On-disk cache of raw responses, keyed on a hash of the request.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def key(url, body):
+        request = json.dumps([url, body], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, content):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first, so a tile is never half written
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(content)
+        os.replace(tmp, path)
+
+
+class TileFetcher:
+    """
+    Fetch getPixels tiles concurrently and mosaic them in memory.
+
+    :parameter session: requests session (fx. a google AuthorizedSession), the
+                        pools of its adapters are enlarged to max_workers
+    :parameter str base_url: url the asset paths are appended to
+    :parameter str cache_dir: directory of the tile cache, None to disable caching
+    :parameter int max_workers: maximum number of requests in flight
+    :parameter int retries: number of retries of a failed request
+    :parameter float backoff: wait before the first retry in seconds, doubled
+                              on every next retry (a Retry-After header wins)
+    :parameter float timeout: timeout of a single request in seconds
+    """
+
+    def __init__(self, session=None, base_url=EE_PUBLIC, cache_dir=None, max_workers=8,
+                 retries=4, backoff=1.0, timeout=120):
+        self.session = make_session(session, pool_size=max_workers)
+        self.base_url = base_url.rstrip('/')
+        self.cache = TileCache(cache_dir) if cache_dir is not None else None
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.stats = {'requests': 0, 'retries': 0, 'cache_hits': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def post(self, url, body):
+        """
+        POST a request, retrying on connection errors and retryable status codes.
+
+        :return: the response content
+        """
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            self._count('requests')
+            try:
+                response = self.session.post(url, json=body, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    raise
+                wait = self.backoff * 2**attempt
+            else:
+                if response.status_code not in RETRY_STATUS or last:
+                    response.raise_for_status()
+                    return response.content
+                retry_after = response.headers.get('Retry-After', '')
+                wait = float(retry_after) if retry_after.isdigit() else self.backoff * 2**attempt
+
+            self._count('retries')
+            time.sleep(wait)
+
+    def get_tile(self, url, body):
+        """
+        Content of one tile, from the cache if available.
+        """
+        if self.cache is None:
+            return self.post(url, body)
+
+        key = self.cache.key(url, body)
+        content = self.cache.get(key)
+        if content is not None:
+            self._count('cache_hits')
+            return content
+
+        content = self.post(url, body)
+        self.cache.put(key, content)
+        return content
+
+    def _request_body(self, bands, grid, file_format, options):
+        body = {'fileFormat': file_format, 'bandIds': list(bands), 'grid': grid}
+        body.update(options or {})
+        return body
+
+    def fetch_stack(self, asset_ids, bands, bounds, scale, crs, tile_size=512,
+                    file_format='NPY', decode=decode_npy, options=None):
+        """
+        Fetch the same area from several assets (fx. a time series) in one go.
+        All tiles of all assets share the same pool of workers.
+
+        :parameter list asset_ids: asset ids, fx. 'COPERNICUS/S2/20220721T095041_20220721T095041_T33UXP'
+        :parameter list bands: band ids to fetch
+        :parameter tuple bounds: (xmin, ymin, xmax, ymax) in the units of crs (see aoi_bounds)
+        :parameter float scale: pixel size in the units of crs (fx. 10 m for the S2 RGB bands)
+        :parameter str crs: CRS code of the pixel grid
+        :parameter int tile_size: width and height of a tile in pixels
+        :parameter str file_format: getPixels file format
+        :parameter decode: function converting a response to a (bands x height x width) array
+        :parameter dict options: extra request fields, fx. visualizationOptions
+        :return: array of shape (n_assets x n_bands x height x width)
+        """
+        if len(asset_ids) == 0:
+            raise ValueError('No asset ids given')
+
+        tiles, (height, width) = make_tiles(bounds, scale, crs, tile_size=tile_size)
+
+        jobs = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for i, asset_id in enumerate(asset_ids):
+                url = f'{self.base_url}/assets/{asset_id}:getPixels'
+                for window, grid in tiles:
+                    body = self._request_body(bands, grid, file_format, options)
+                    jobs[executor.submit(self.get_tile, url, body)] = (i, window)
+
+            mosaic = None
+            for future in concurrent.futures.as_completed(jobs):
+                i, (row, col, h, w) = jobs[future]
+                data = decode(future.result())
+                if mosaic is None:
+                    mosaic = np.zeros((len(asset_ids), data.shape[0], height, width),
+                                      dtype=data.dtype)
+                # crop the tile to the part inside the mosaic
+                r0, c0 = max(row, 0), max(col, 0)
+                r1, c1 = min(row + h, height), min(col + w, width)
+                mosaic[i, :, r0:r1, c0:c1] = data[:, r0 - row:r1 - row, c0 - col:c1 - col]
+
+        return mosaic
+
+    def fetch(self, asset_id, bands, bounds, scale, crs, **kwargs):
+        """
+        Fetch an area from one asset, see fetch_stack for the parameters.
+
+        :return: array of shape (n_bands x height x width)
+        """
+        return self.fetch_stack([asset_id], bands, bounds, scale, crs, **kwargs)[0]